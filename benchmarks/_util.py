@@ -0,0 +1,11 @@
+'''
+Timing helpers shared by the benchmark scripts.
+'''
+import timeit
+
+
+def best(func, repeat=3):
+    '''
+    Fastest of `repeat` single calls of func, in seconds.
+    '''
+    return min(timeit.repeat(func, number=1, repeat=repeat))
@@ -0,0 +1,150 @@
+'''
+Benchmarks for datainterface.readers.read_eeg on synthetic Micromed files.
+
+Run from the repository root:
+
+    python benchmarks/bench_read_eeg.py
+'''
+from __future__ import print_function, division
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+import multiprocessing
+import resource
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from datainterface.readers import read_eeg
+from micromed_synth import write_micromed
+from _util import best
+
+
+def bench_windowed_read(tmpdir, minutes=10, nchan=128, srate=512, window=30.):
+    fname = os.path.join(tmpdir, 'window.EEG')
+    raw, chscale = write_micromed(fname, nsamp=int(minutes * 60 * srate),
+                                  nchan=nchan, srate=srate)
+    eeg = read_eeg.EEG(fname, verbose=False)
+
+    full, tfull = eeg.read_data()
+    expected = (raw.T.astype(np.float32) *
+                chscale[:, np.newaxis]).astype(np.float32)
+    np.testing.assert_array_equal(full, expected)
+
+    t0 = minutes * 60 / 2.
+    data, t = eeg.read_data(t0, t0 + window)
+    i0, i1 = int(t0 * srate), int((t0 + window) * srate)
+    np.testing.assert_array_equal(data, full[:, i0:i1])
+    np.testing.assert_allclose(t, tfull[i0:i1])
+
+    tw = best(lambda: eeg.read_data(t0, t0 + window), repeat=5)
+    tf = best(lambda: eeg.read_data(), repeat=2)
+    print('windowed read: %.0f s of a %d min file, %d channels' %
+          (window, minutes, nchan))
+    print('  full read   %8.1f ms' % (tf * 1e3))
+    print('  window read %8.1f ms  (%.0fx)' % (tw * 1e3, tf / tw))
+
+
+def bench_channel_selection(tmpdir, nchan=256, srate=1024, window=60.):
+    fname = os.path.join(tmpdir, 'channels.EEG')
+    write_micromed(fname, nsamp=int(window * srate), nchan=nchan, srate=srate)
+    eeg = read_eeg.EEG(fname, verbose=False)
+    full, _ = eeg.read_data()
+
+    print('channel selection: %.0f s window, %d channels' % (window, nchan))
+    tf = best(lambda: eeg.read_data(), repeat=5)
+    print('  %4d channels %8.1f ms' % (nchan, tf * 1e3))
+    rng = np.random.RandomState(0)
+    for nsel in (1, 10, 32, 64, 128):
+        names = [eeg.chnm[i] for i in
+                 sorted(rng.choice(nchan, nsel, replace=False))]
+        data, _, chnm, _ = eeg.read_data(channels=names,
+                                         return_channels=True)
+        assert chnm == names
+        np.testing.assert_array_equal(
+            data, full[[eeg.chnm.index(c) for c in names]])
+        ts = best(lambda: eeg.read_data(channels=names), repeat=5)
+        print('  %4d channels %8.1f ms  (%.1fx)' % (nsel, ts * 1e3, tf / ts))
+
+
+def _legacy_read_data(eeg):
+    # read_data as it was before the single-pass conversion
+    with open(eeg.filename, 'rb') as fd:
+        fd.seek(eeg.data_offset + read_eeg.frequencyGroup.itemsize)
+        buff = fd.read(int(eeg.nsamp) * eeg.nchan * 2)
+    data = np.frombuffer(buff, np.int16).reshape((-1, eeg.nchan)).T
+    data = data.astype(np.float32) * eeg.chscale[:, np.newaxis]
+    return data.astype(np.float32)
+
+
+def _peak_rss(func, queue):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tstart = timeit.default_timer()
+    func()
+    elapsed = timeit.default_timer() - tstart
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(((after - before) / 1024., elapsed))
+
+
+def _measure(func):
+    # run in a fresh process so each variant starts from the same high-water
+    # mark; ru_maxrss is in kB on Linux
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_peak_rss, args=(func, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def bench_conversion(tmpdir, minutes=5, nchan=256, srate=1024):
+    fname = os.path.join(tmpdir, 'convert.EEG')
+    write_micromed(fname, nsamp=int(minutes * 60 * srate), nchan=nchan,
+                   srate=srate)
+    eeg = read_eeg.EEG(fname, verbose=False)
+    np.testing.assert_array_equal(eeg.read_data()[0], _legacy_read_data(eeg))
+    out32 = np.empty((eeg.nchan, int(eeg.nsamp)), np.float32)
+    out64 = np.empty((eeg.nchan, int(eeg.nsamp)), np.float64)
+    mb = eeg.nsamp * eeg.nchan * 2 / 2. ** 20
+
+    print('int16 -> physical conversion: %d min, %d channels, %.0f MB on '
+          'disk, %.0f MB as float32' % (minutes, nchan, mb, 2 * mb))
+    for name, func in [
+            ('legacy float32', lambda: _legacy_read_data(eeg)),
+            ('float32', lambda: eeg.read_data()),
+            ('float32 out=', lambda: eeg.read_data(out=out32)),
+            ('float64', lambda: eeg.read_data(dtype=np.float64)),
+            ('float64 out=', lambda: eeg.read_data(out=out64))]:
+        rss, _ = _measure(func)
+        elapsed = best(func, repeat=3)
+        print('  %-16s peak RSS +%7.1f MB  %7.1f MB/s' %
+              (name, rss, mb / elapsed))
+
+
+def bench_export(tmpdir, minutes=5, nchan=256, srate=1024):
+    fname = os.path.join(tmpdir, 'export.EEG')
+    write_micromed(fname, nsamp=int(minutes * 60 * srate), nchan=nchan,
+                   srate=srate)
+    eeg = read_eeg.EEG(fname, verbose=False)
+    mb = eeg.nsamp * eeg.nchan * 4 / 2. ** 20
+    print('export: %d min, %d channels, %.0f MB as float32' %
+          (minutes, nchan, mb))
+    for name, func in [
+            ('mat v5', lambda: eeg.to_mat(fname + '.5.mat', version='5')),
+            ('mat v7.3', lambda: eeg.to_mat(fname + '.mat')),
+            ('npy', lambda: eeg.save_to_npy(fname + '.npy'))]:
+        rss, elapsed = _measure(func)
+        print('  %-10s peak RSS +%7.1f MB  %6.2f s' % (name, rss, elapsed))
+
+
+if __name__ == '__main__':
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bench_windowed_read(tmpdir)
+        bench_channel_selection(tmpdir)
+        bench_conversion(tmpdir)
+        bench_export(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
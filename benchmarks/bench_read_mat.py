@@ -0,0 +1,107 @@
+'''
+Round-trip benchmark of the MatReader sidecar format (manifest.json plus a
+directory of .npy files) against the former convertMatToJSON format
+(protocol 0 pickles inside bz2-compressed JSON).
+
+Run from the repository root:
+
+    python benchmarks/bench_read_mat.py
+'''
+from __future__ import print_function, division
+import os
+import sys
+import bz2
+import json
+import pickle
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from datainterface.readers.read_mat import MatReader
+from _util import best
+
+
+def _legacy_write(matData, fileName):
+    # convertMatToJSON as it was, with pickles kept as latin-1 text so the
+    # JSON can hold them on Python 3
+    jsonData = {}
+    for key in matData.keys():
+        if (type(matData[key])) is np.ndarray:
+            jsonData[key] = pickle.dumps(matData[key],
+                                         protocol=0).decode('latin-1')
+        else:
+            jsonData[key] = matData[key]
+    with bz2.BZ2File(fileName, 'wb') as f:
+        f.write(json.dumps(jsonData).encode('utf-8'))
+
+
+def _legacy_read(fileName, keys):
+    with bz2.BZ2File(fileName, 'rb') as f:
+        jsonData = json.loads(f.read().decode('utf-8'))
+    for key in keys:
+        jsonData[key] = pickle.loads(jsonData[key].encode('latin-1'))
+    return jsonData
+
+
+def _dirsize(dirname):
+    return sum(os.path.getsize(os.path.join(dirname, name))
+               for name in os.listdir(dirname))
+
+
+def bench_roundtrip(tmpdir, nchan=128, nwin=2000):
+    rng = np.random.RandomState(0)
+    matData = {
+        'fragility': rng.rand(nchan, nwin),
+        'pertmats': rng.rand(nchan, nwin).astype(np.float32),
+        'ltvmodel': rng.randn(nchan, nchan, 8),
+        'chanlabels': np.array(['C%d' % i for i in range(nchan)]),
+        'samplerate': 1000.,
+        'patient': 'id001_ac',
+    }
+    arrays = [key for key, value in matData.items()
+              if isinstance(value, np.ndarray)]
+    mb = sum(matData[key].nbytes for key in arrays) / 2. ** 20
+    reader = MatReader()
+    legacy = os.path.join(tmpdir, 'legacy.json.bz2')
+    sidecar = os.path.join(tmpdir, 'sidecar')
+
+    _legacy_write(matData, legacy)
+    reader.convertMatToSidecar(matData, sidecar)
+    old = _legacy_read(legacy, arrays)
+    new = reader.loadSidecar(sidecar)
+    for key in arrays:
+        np.testing.assert_array_equal(old[key], matData[key])
+        np.testing.assert_array_equal(new[key], matData[key])
+    assert new['samplerate'] == matData['samplerate']
+
+    print('round trip: %.1f MB of arrays' % mb)
+    print('  %-16s %8s %8s %8s %10s' % ('', 'write', 'read', 'read+use',
+                                         'size'))
+    for name, write, read, size in [
+            ('legacy json.bz2',
+             lambda: _legacy_write(matData, legacy),
+             lambda: _legacy_read(legacy, arrays),
+             lambda: os.path.getsize(legacy)),
+            ('sidecar mmap',
+             lambda: reader.convertMatToSidecar(matData, sidecar),
+             lambda: reader.loadSidecar(sidecar),
+             lambda: _dirsize(sidecar)),
+            ('sidecar load',
+             lambda: reader.convertMatToSidecar(matData, sidecar),
+             lambda: reader.loadSidecar(sidecar, mmap_mode=None),
+             lambda: _dirsize(sidecar))]:
+        tw = best(write)
+        tr = best(read)
+        tu = best(lambda: read()['fragility'][:, :100].sum())
+        print('  %-16s %7.3fs %7.3fs %7.3fs %8.1f MB' %
+              (name, tw, tr, tu, size() / 2. ** 20))
+
+
+if __name__ == '__main__':
+    tmpdir = tempfile.mkdtemp()
+    try:
+        bench_roundtrip(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,137 @@
+'''
+Benchmarks for datainterface.readers.surfgeom against the per-triangle
+Python loops, on synthetic closed meshes of several sizes.
+
+Run from the repository root:
+
+    python benchmarks/bench_surfgeom.py
+'''
+from __future__ import print_function, division
+import os
+import sys
+import numpy as np
+import scipy.sparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from datainterface.readers import surfgeom
+from _util import best
+
+
+def sphere_mesh(n):
+    '''
+    A UV sphere with about n * n vertices: two poles and n rings of n
+    vertices, every quad of neighbouring rings split in two triangles.
+    '''
+    theta = np.linspace(0, np.pi, n + 2)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    vertices = np.vstack([
+        [0, 0, 1],
+        np.column_stack([(np.sin(t) * np.cos(p)).ravel(),
+                         (np.sin(t) * np.sin(p)).ravel(),
+                         np.cos(t).ravel()]),
+        [0, 0, -1]])
+    ring = np.arange(n)
+    nxt = (ring + 1) % n
+    tris = [np.column_stack([np.zeros(n, int), 1 + ring, 1 + nxt])]
+    for r in range(n - 1):
+        a, b = 1 + r * n + ring, 1 + r * n + nxt
+        c, d = a + n, b + n
+        tris.append(np.column_stack([a, c, b]))
+        tris.append(np.column_stack([b, c, d]))
+    last = len(vertices) - 1
+    tris.append(np.column_stack([np.full(n, last), 1 + (n - 1) * n + nxt,
+                                 1 + (n - 1) * n + ring]))
+    return vertices, np.vstack(tris)
+
+
+def _legacy_vertex_areas(vertices, triangles):
+    # LoadSurface._compute_vertex_areas as it was, minus its (ntri, 1) areas
+    triangle_areas = surfgeom.triangle_areas(vertices, triangles)
+    vertex_areas = np.zeros((vertices.shape[0]))
+    for triang, verts in enumerate(triangles):
+        for i in range(3):
+            vertex_areas[verts[i]] += 1. / 3. * triangle_areas[triang]
+    return vertex_areas
+
+
+def _legacy_vertex_normals(vertices, triangles):
+    normals = np.zeros(vertices.shape)
+    for tri in triangles:
+        v0, v1, v2 = vertices[tri]
+        n = np.cross(v1 - v0, v2 - v0)
+        for i in tri:
+            normals[i] += n
+    for i in range(len(normals)):
+        norm = np.sqrt(np.dot(normals[i], normals[i]))
+        if norm > 0:
+            normals[i] /= norm
+    return normals
+
+
+def _legacy_region_areas(areas, regmap, nregions):
+    region_areas = np.zeros(nregions)
+    for area, reg in zip(areas, regmap):
+        if reg >= 0:
+            region_areas[reg] += area
+    return region_areas
+
+
+def _legacy_adjacency(triangles, nvertices):
+    neighbours = [set() for _ in range(nvertices)]
+    for tri in triangles:
+        for i in range(3):
+            for j in range(3):
+                if i != j:
+                    neighbours[tri[i]].add(tri[j])
+    rows = [i for i, js in enumerate(neighbours) for _ in js]
+    cols = [j for js in neighbours for j in js]
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(rows), np.int8), (rows, cols)),
+        shape=(nvertices, nvertices))
+
+
+def bench_kernels(sizes=(16, 64, 160)):
+    rng = np.random.RandomState(0)
+    print('%-14s %8s %10s %10s %8s' % ('kernel', 'vertices', 'loop',
+                                       'vectorized', 'speedup'))
+    for n in sizes:
+        vertices, triangles = sphere_mesh(n)
+        nvert = len(vertices)
+        nregions = 80
+        regmap = rng.randint(-1, nregions, nvert)
+        areas = surfgeom.vertex_areas(vertices, triangles)
+
+        np.testing.assert_allclose(
+            areas, _legacy_vertex_areas(vertices, triangles))
+        np.testing.assert_allclose(
+            surfgeom.vertex_normals(vertices, triangles),
+            _legacy_vertex_normals(vertices, triangles), atol=1e-12)
+        np.testing.assert_allclose(
+            surfgeom.region_areas(areas, regmap, nregions),
+            _legacy_region_areas(areas, regmap, nregions))
+        assert (surfgeom.adjacency(triangles, nvert) !=
+                _legacy_adjacency(triangles, nvert)).nnz == 0
+
+        for name, loop, vec in [
+                ('vertex areas',
+                 lambda: _legacy_vertex_areas(vertices, triangles),
+                 lambda: surfgeom.vertex_areas(vertices, triangles)),
+                ('vertex normals',
+                 lambda: _legacy_vertex_normals(vertices, triangles),
+                 lambda: surfgeom.vertex_normals(vertices, triangles)),
+                ('region areas',
+                 lambda: _legacy_region_areas(areas, regmap, nregions),
+                 lambda: surfgeom.region_areas(areas, regmap, nregions)),
+                ('adjacency',
+                 lambda: _legacy_adjacency(triangles, nvert),
+                 lambda: surfgeom.adjacency(triangles, nvert))]:
+            tl = best(loop, repeat=1)
+            tv = best(vec)
+            print('%-14s %8d %9.3fs %9.4fs %7.0fx' % (name, nvert, tl, tv,
+                                                      tl / tv))
+
+
+if __name__ == '__main__':
+    bench_kernels()
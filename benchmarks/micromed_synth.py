@@ -0,0 +1,90 @@
+'''
+Writes small synthetic Micromed/COHERENCE .EEG files so that the readers
+in datainterface.readers.read_eeg can be exercised without clinical data.
+
+Only the blocks that read_eeg.EEG parses are emitted: patient info, the
+crypted data descriptor, a single multiplexed int16 data block and the
+markers.
+'''
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from datainterface.readers import read_eeg
+
+
+def crypt(buff):
+    '''
+    Inverse of read_eeg.uncrypt.
+    '''
+    _ = np.frombuffer(buff, dtype=np.int8).astype(np.int64)
+    for i in range(len(_) - 2, -1, -1):
+        _[i] ^= _[i + 1] ^ (i + 1)
+    return _.astype(np.int8).tobytes()
+
+
+def _block(code, payload=b''):
+    hdr = np.zeros(1, read_eeg.header)
+    hdr['codeBlock'] = code
+    hdr['blockLen'] = len(payload)
+    return hdr.tobytes() + payload
+
+
+def write_micromed(filename, nsamp=10000, nchan=16, srate=512,
+                   chnm=None, markers=None, file_nbrs=(-1, 0, -1), seed=0):
+    '''
+    Write a synthetic recording and return the raw int16 samples of shape
+    (nsamp, nchan) together with the per-channel scale. `markers` is an
+    optional list of (sample, code) pairs written as a marker block and
+    `file_nbrs` the (prev, this, next) file numbers of a multi-file session.
+    '''
+    rng = np.random.RandomState(seed)
+    raw = rng.randint(-2000, 2000, size=(nsamp, nchan)).astype(np.int16)
+    if chnm is None:
+        chnm = ['C%d' % i for i in range(nchan)]
+
+    ident = np.zeros(1, read_eeg.identificateur)
+    ident['coherence'] = b'COHERENCE'
+    ident['versionMaj'] = 3
+    ident['versionMin'] = 6
+    ident['firstBlockPos'] = read_eeg.identificateur.itemsize
+    ident['prevFileNbr'], ident['thisFileNbr'], ident['nextFileNbr'] = \
+        file_nbrs
+
+    ip = np.zeros(1, read_eeg.infoPatient)
+    ip['PatientName'] = b'Synthetic'
+    ip['patientNumber'] = b'0000'
+
+    desc = np.zeros(1, read_eeg.descripteur1024)
+    desc['recordLenInSeconds'] = nsamp // srate
+    desc['sampleFrequencyGroup'][0, 0] = srate
+    desc['totalNbChannels'] = nchan
+    desc['nbUsedChannels'] = nchan
+    for i, name in enumerate(chnm):
+        desc['channelName'][0, i] = name.encode('ascii')
+    desc['channelKind'][0, :nchan] = 4
+    desc['analogMax'][0, :nchan] = rng.randint(100, 1000, size=nchan)
+    desc['convMax'] = 32767
+    chscale = (desc['analogMax'][0] * 1.0 / desc['convMax'][0])[:nchan]
+
+    fg = np.zeros(1, read_eeg.frequencyGroup)
+    fg['totalNbChannels'] = nchan
+    fg['NbUsedChannels'] = nchan
+
+    mk = np.zeros(len(markers or []), read_eeg.marker)
+    if markers:
+        mk['sample'], mk['code'] = zip(*markers)
+
+    with open(filename, 'wb') as fd:
+        fd.write(ident.tobytes())
+        fd.write(_block(0xCAFD0300))
+        fd.write(_block(0xCAFD0301, ip.tobytes()))
+        fd.write(_block(0xCAFD0100))
+        fd.write(_block(0xCAFD0101, crypt(desc.tobytes())))
+        fd.write(_block(0xCAFD0102, fg.tobytes() + raw.tobytes()))
+        fd.write(_block(0xCAFD0200))
+        fd.write(_block(0xCAFD0201, mk.tobytes()))
+        fd.write(_block(0))
+    return raw, chscale
@@ -4,6 +4,7 @@ import numpy as np
 import pandas as pd
 import fragility
 from .utils import utils
+from .readers.metastore import MetaStore, METASTORE_NAME, TABLES
 
 import datetime
 import time
@@ -22,12 +23,16 @@ class LoadPat(object):
             - <p>_annotations.csv
             - <p>_chans.csv
             - <p>_headers.csv
+        metadata.sqlite (optional)
+
+    The meta data is read from the metadata.sqlite store of the dataset when
+    it holds the patient, and from the per-patient csv files otherwise.
 
     This mainly is the format that is the output of the dataconversion.py file from EDF files.
 
     Will need to reformat for other type of EEG files.
     '''
-    def __init__(self, patient, datadir, clinoutcome=None):
+    def __init__(self, patient, datadir, clinoutcome=None, metastore=None):
         self.patient = patient
         self.datadir = datadir
         self.rawdatafile = patient + '_rawnpy.npy'
@@ -36,6 +41,19 @@ class LoadPat(object):
         self.headersfile = patient + '_headers.csv'
         self.clinoutcome = clinoutcome
         self.reference = None
+        if metastore is None:
+            metastore = os.path.join(datadir, METASTORE_NAME)
+        # the patient's metadata tables, read at once so the store is closed
+        self.metatables = None
+        if os.path.exists(metastore):
+            store = MetaStore(metastore)
+            try:
+                if patient in store:
+                    self.metatables = dict(
+                        (table, store.read(table, patient))
+                        for table in TABLES)
+            finally:
+                store.close()
         # get relevant channel data
         self.patid, self.seizid = utils.splitpatient(patient)
         self.included_chans, self.onsetchans, self.clinresult = utils.returnindices(
@@ -58,6 +76,11 @@ class LoadPat(object):
     def _metafilepath(self, filename):
         return os.path.join(self.datadir, self.patient, filename)
 
+    def _loadmetatable(self, table, filename):
+        if self.metatables is not None:
+            return self.metatables[table].copy()
+        return pd.read_csv(self._metafilepath(filename))
+
     def get_clindata(self):
         clindata = {
             'onset_time': self.onset_time,
@@ -70,9 +93,8 @@ class LoadPat(object):
         return clindata
 
     def loadchans_fromfile(self):
-        chansfile = self._metafilepath(self.channelsfile)
-        # read in the csv file into pandas
-        chanheaders = pd.read_csv(chansfile)
+        # read in the channel table into pandas
+        chanheaders = self._loadmetatable('channels', self.channelsfile)
         # read in labels
         chanlabels = chanheaders['Labels']
         self.chanlabels = chanlabels.values
@@ -148,9 +170,8 @@ class LoadPat(object):
         return rawdata
 
     def loadheaders_fromfile(self):
-        headersfile = self._metafilepath(self.headersfile)
         # read in the file headers into pandas
-        fileheaders = pd.read_csv(headersfile)
+        fileheaders = self._loadmetatable('headers', self.headersfile)
 
         # get important meta data (ADD ELEMENTS HERE TO ADD TO CLASS)
         birthdate = fileheaders['Birth Date']
@@ -191,9 +212,8 @@ class LoadPat(object):
         Here, we mainly are interested in the onset/offset times
         if they are present...
         '''
-        annotationsfile = self._metafilepath(self.annotationsfile)
         # read in the clinical annotations into pandas
-        annotations = pd.read_csv(annotationsfile)
+        annotations = self._loadmetatable('annotations', self.annotationsfile)
         descriptions = annotations['Description'].values
 
         onset_time = []
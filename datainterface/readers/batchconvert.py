@@ -0,0 +1,192 @@
+'''
+Helpers shared by the bulk converters in this package.
+
+- source_stamp, is_unchanged: tell whether a file changed since a record
+- Manifest: a resumable JSON-lines log of converted files
+- convert_record: run one conversion and describe its outcome
+- run_pool: fan jobs out over a pool of worker processes or threads
+- save_channel_major_npy: write a recording to .npy block by block
+- replacing_dir: write a directory of outputs and swap it in whole
+'''
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import multiprocessing
+import multiprocessing.pool
+import numpy as np
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def file_checksum(path, blocksize=1 << 20):
+    '''
+    md5 hex digest of a file, read in blocks of `blocksize` bytes.
+    '''
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fd:
+        for block in iter(lambda: fd.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def source_stamp(path, prefix=''):
+    '''
+    The absolute path, size and mtime of `path`, as the record fields
+    <prefix>path, <prefix>size and <prefix>mtime.
+    '''
+    st = os.stat(path)
+    return {prefix + 'path': os.path.abspath(path),
+            prefix + 'size': st.st_size,
+            prefix + 'mtime': st.st_mtime}
+
+
+def is_unchanged(record, path, prefix=''):
+    '''
+    True when `record` holds the source_stamp that `path` has now, i.e. it
+    was made from this very file and the file was not modified since.
+    '''
+    return all(record.get(key) == value
+               for key, value in source_stamp(path, prefix).items())
+
+
+class Manifest(object):
+    '''
+    Append-only JSON-lines log of conversion records keyed by output path.
+
+    The last record of an output wins, so an interrupted run is resumed by
+    skipping outputs recorded as done whose source is unchanged and whose
+    output is still on disk with the recorded size.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'r') as fd:
+                for line in fd:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # last line truncated by an interrupted run
+                        continue
+                    self.records[rec['output']] = rec
+
+    def is_done(self, source, output):
+        rec = self.records.get(output)
+        if rec is None or rec['status'] != 'done' or rec['source'] != source:
+            return False
+        if not os.path.exists(output):
+            return False
+        return (is_unchanged(rec, source, 'source_') and
+                rec['size'] == os.path.getsize(output))
+
+    def add(self, rec):
+        self.records[rec['output']] = rec
+        with open(self.path, 'a') as fd:
+            fd.write(json.dumps(rec) + '\n')
+
+
+def convert_record(convert, source, output, *args):
+    '''
+    Call convert(source, output, *args) and return a manifest record with
+    the status, output size, duration and checksum. Failures, including
+    hitting a worker memory limit, are recorded rather than raised.
+    '''
+    rec = dict(source=source, output=output)
+    rec.update(source_stamp(source, 'source_'))
+    tstart = time.time()
+    try:
+        convert(source, output, *args)
+    except Exception as e:
+        rec.update(status='failed', error='%s: %s' % (type(e).__name__, e))
+    else:
+        rec.update(status='done', size=os.path.getsize(output),
+                   checksum=file_checksum(output))
+    rec['duration'] = time.time() - tstart
+    return rec
+
+
+def save_channel_major_npy(filename, blocks, nchan, nsamp,
+                           dtype=np.float32):
+    '''
+    Write a channel-major, C-contiguous (nchan, nsamp) .npy, which np.load
+    can memory-map, from `blocks`: (i0, block) pairs where block holds the
+    (nchan, n) samples starting at sample i0. Each block row is seeked into
+    place, so only one block is in memory at a time.
+    '''
+    dtype = np.dtype(dtype)
+    with open(filename, 'wb') as out:
+        np.lib.format.write_array_header_1_0(out, {
+            'descr': np.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False,
+            'shape': (nchan, nsamp)})
+        offset = out.tell()
+        out.truncate(offset + nchan * nsamp * dtype.itemsize)
+        for i0, block in blocks:
+            block = np.asarray(block, dtype)
+            for c in range(nchan):
+                out.seek(offset + (c * nsamp + i0) * dtype.itemsize)
+                block[c].tofile(out)
+
+
+@contextlib.contextmanager
+def replacing_dir(path):
+    '''
+    Yield a new temporary directory next to `path` to write into, renamed to
+    `path` once the block completes and removed if it raises. A directory
+    already at `path` is replaced as a whole, never overwritten in place, so
+    arrays memory mapped from its files keep their content.
+    '''
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    tmpdir = tempfile.mkdtemp(prefix='.%s-' % os.path.basename(path),
+                              dir=parent)
+    os.chmod(tmpdir, 0o755)
+    try:
+        yield tmpdir
+        if os.path.exists(path):
+            olddir = tempfile.mkdtemp(prefix='.old-', dir=parent)
+            os.rename(path, os.path.join(olddir, 'old'))
+            os.rename(tmpdir, path)
+            shutil.rmtree(olddir, ignore_errors=True)
+        else:
+            os.rename(tmpdir, path)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def _limit_memory(max_bytes):
+    if max_bytes and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def run_pool(func, jobs, workers=None, max_memory=None, threads=False):
+    '''
+    Apply `func` to every job in a pool of `workers` processes and yield the
+    results in completion order. Each worker is replaced after one job so
+    memory is returned between files, and is optionally capped at
+    `max_memory` bytes of address space. With threads=True the jobs run on
+    a pool of threads instead, e.g. for I/O bound jobs or shared caches.
+    '''
+    if threads:
+        pool = multiprocessing.pool.ThreadPool(workers)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=_limit_memory,
+                                    initargs=(max_memory, ),
+                                    maxtasksperchild=1)
+    try:
+        for result in pool.imap_unordered(func, jobs):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,67 @@
+'''
+In-process caches shared by the readers in this package.
+'''
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    Thread-safe least-recently-used mapping.
+
+    maxsize             (int) maximum number of entries, None for no limit
+    maxbytes            (int) maximum total size of the entries as measured
+                        by `sizeof`, None for no limit
+    sizeof              (callable) size in bytes of a cached value
+
+    hits, misses and nbytes keep track of how the cache is doing.
+    '''
+
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = (value, size)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            if self.maxbytes is not None and size > self.maxbytes:
+                # would evict everything else and still not fit
+                return
+            self._data[key] = (value, size)
+            self.nbytes += size
+            while ((self.maxsize is not None and
+                    len(self._data) > self.maxsize) or
+                   (self.maxbytes is not None and
+                    self.nbytes > self.maxbytes)):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
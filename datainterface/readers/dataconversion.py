@@ -7,7 +7,7 @@ Module for converting raw data sent by clinicians into easily read formats for p
 
 Classes:
 1. EDFConverter
-Converts data from .edf format into .csv and .numpy files. Allows for logging to determine the quality of data conversion for every dataset passed through this pipeline.
+Converts data from .edf format into .csv and .numpy files, or the meta data into a metastore.MetaStore. Allows for logging to determine the quality of data conversion for every dataset passed through this pipeline.
 
 2.
 
@@ -17,6 +17,8 @@ import numpy as np
 import pandas as pd
 import pyedflib
 import os
+import sys
+from .metastore import HEADER_COLUMNS, CHANNEL_COLUMNS, ANNOTATION_COLUMNS
 
 class EDFConverter(object):
     '''
@@ -197,12 +199,55 @@ class EDFConverter(object):
         # 1. CSV file of EDF file headers in outputFileHeaders path
         # 2. CSV file of EDF channel headers in outputChanHeaders path
 
+        tables = self.edfmetadata()
+
+        # create dataframes from array of meta data, header row first
+        fileheaders_df = pd.DataFrame(
+            data=[HEADER_COLUMNS] + tables['headers'])
+        channelheaders_df = pd.DataFrame(
+            data=[CHANNEL_COLUMNS] + tables['channels'])
+        annotationheaders_df = pd.DataFrame(
+            data=[ANNOTATION_COLUMNS] + tables['annotations'])
+
+        # create CSV file of file header names and data
+        fileheaders_df.to_csv(outputheadersfile, index=False, header=False)
+        # create CSV file of channel header names and data
+        channelheaders_df.to_csv(outputchanfile, index=False, header=False)
+        # create CSV file of channel header names and data
+        annotationheaders_df.to_csv(
+            outputannotationsfile, index=False, header=False)
+
+        # output logging statements
+        sys.stderr.write(
+            'Headers meta data should be saved as csv at %s\n' %
+            outputheadersfile)
+        sys.stderr.write(
+            'Channel meta data should be saved as csv at %s\n' %
+            outputchanfile)
+        sys.stderr.write(
+            'Annotations meta data should be saved as csv at %s\n' %
+            outputannotationsfile)
+
+    def edfmetatostore(self, store, recording):
+        '''
+        Write the file headers, channel headers and annotations of the edf
+        file as `recording` into a metastore.MetaStore, in place of the three
+        csv files of edfmetatocsv.
+        '''
+        store.put_many([(recording, self.edfmetadata())])
+
+    def edfmetadata(self):
+        '''
+        Read the meta data of the edf file into a dict of row lists for the
+        'headers', 'channels' and 'annotations' tables, each row ordered as
+        the columns in metastore.
+        '''
         # open input file if closed
         try:
             edffile = pyedflib.EdfReader(self.edffile)
         except BaseException:
             sys.stderr.write("Already opened file!")
-            sys.stderr.write('Failed to read edf file', exc_info=True)
+            sys.stderr.write('Failed to read edf file')
             edffile._close()
 
         self.__edffilecheck(edffile)
@@ -210,30 +255,13 @@ class EDFConverter(object):
         numchans = edffile.signals_in_file
 
         ######################### 1. Import file headers ######################
-        # create list with dataframe column file header names
-        fileheaders = [[
-            'pyedfib Version',
-            'Birth Date',
-            'Gender',
-            'Start Date (D-M-Y)',
-            'Start Time (H-M-S)',
-            'Patient Code',
-            'Equipment',
-            'Data Record Duration (s)',
-            'Number of Data Records in File',
-            'Number of Annotations in File',
-            'Sample Frequency',
-            'Samples in File',
-            'Physical Dimension'
-        ]]
-
         # append file header data for each dataframe column to list
         startdate = str(edffile.getStartdatetime().day) + '-' + str(
             edffile.getStartdatetime().month) + '-' + str(edffile.getStartdatetime().year)
         starttime = str(edffile.getStartdatetime().hour) + '-' + str(
             edffile.getStartdatetime().minute) + '-' + str(edffile.getStartdatetime().second)
 
-        fileheaders.append([
+        fileheaders = [[
             pyedflib.version.version,
             edffile.birthdate,
             edffile.gender,
@@ -247,21 +275,10 @@ class EDFConverter(object):
             edffile.getSampleFrequency(0),
             edffile.getNSamples()[0],
             edffile.getPhysicalDimension(1),
-        ])
+        ]]
 
         ##################### 2. Import channel headers #######################
-        # create list with dataframe column channel header names
-        channelheaders = [[
-            'Channel Number',
-            'Labels',
-            'Physical Maximum',
-            'Physical Minimum',
-            'Digital Maximum',
-            'Digital Minimum',
-            'Sample Frequency',
-            'Num Samples',
-            'Physical Dimensions',
-        ]]
+        channelheaders = []
 
         # get the channel labels of file and convert to list of strings
         # -> also gets rid of excessive characters
@@ -300,13 +317,7 @@ class EDFConverter(object):
                 ])
 
         ##################### 3. Import File Annotations ######################
-        # create list
-        annotationheaders = [[
-            'Time (sec)',
-            'Duration',
-            'Description'
-        ]]
-
+        annotationheaders = []
         annotations = edffile.readAnnotations()
         for n in np.arange(edffile.annotations_in_file):
             annotationheaders.append([
@@ -315,29 +326,8 @@ class EDFConverter(object):
                 annotations[2][n]
             ])
 
-        # create dataframes from array of meta data
-        fileheaders_df = pd.DataFrame(data=fileheaders)
-        channelheaders_df = pd.DataFrame(data=channelheaders)
-        annotationheaders_df = pd.DataFrame(data=annotationheaders)
-
-        # create CSV file of file header names and data
-        fileheaders_df.to_csv(outputheadersfile, index=False, header=False)
-        # create CSV file of channel header names and data
-        channelheaders_df.to_csv(outputchanfile, index=False, header=False)
-        # create CSV file of channel header names and data
-        annotationheaders_df.to_csv(
-            outputannotationsfile, index=False, header=False)
-
-        # output logging statements
-        sys.stderr.write(
-            'Closing edf file! Headers meta data should be saved as csv at %s',
-            outputheadersfile)
-        sys.stderr.write(
-            'Channel meta data should be saved as csv at %s',
-            outputchanfile)
-        sys.stderr.write(
-            'Annotations meta data should be saved as csv at %s',
-            outputannotationsfile)
-
         # close the file
         edffile._close()
+        return {'headers': fileheaders,
+                'channels': channelheaders,
+                'annotations': annotationheaders}
@@ -0,0 +1,138 @@
+'''
+Per-dataset metadata store.
+
+A single SQLite file holds the header, channel and annotation tables of
+every recording of a dataset, instead of the three CSV files per recording
+written by the converters. Rows are written in batch and read back, or
+queried across recordings, without opening one file per recording.
+'''
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# default file name of the store inside a dataset directory
+METASTORE_NAME = 'metadata.sqlite'
+
+# column names of each table, as in the per-recording CSV files
+HEADER_COLUMNS = [
+    'pyedfib Version',
+    'Birth Date',
+    'Gender',
+    'Start Date (D-M-Y)',
+    'Start Time (H-M-S)',
+    'Patient Code',
+    'Equipment',
+    'Data Record Duration (s)',
+    'Number of Data Records in File',
+    'Number of Annotations in File',
+    'Sample Frequency',
+    'Samples in File',
+    'Physical Dimension'
+]
+CHANNEL_COLUMNS = [
+    'Channel Number',
+    'Labels',
+    'Physical Maximum',
+    'Physical Minimum',
+    'Digital Maximum',
+    'Digital Minimum',
+    'Sample Frequency',
+    'Num Samples',
+    'Physical Dimensions',
+]
+ANNOTATION_COLUMNS = [
+    'Time (sec)',
+    'Duration',
+    'Description'
+]
+TABLES = {
+    'headers': HEADER_COLUMNS,
+    'channels': CHANNEL_COLUMNS,
+    'annotations': ANNOTATION_COLUMNS,
+}
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _sqlvalue(value):
+    # sqlite3 only adapts builtin types
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class MetaStore(object):
+    '''
+    Header, channel and annotation tables of all recordings of a dataset,
+    stored in one SQLite file. Every row carries the name of its recording,
+    i.e. the <patient> directory name used by LoadPat.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        with self.conn:
+            for table, columns in TABLES.items():
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS %s (recording TEXT NOT NULL, %s)'
+                    % (table, ', '.join(_quote(c) for c in columns)))
+                self.conn.execute(
+                    'CREATE INDEX IF NOT EXISTS %s_recording ON %s (recording)'
+                    % (table, table))
+
+    def close(self):
+        self.conn.close()
+
+    def put_many(self, items):
+        '''
+        Replace the metadata of many recordings in a single transaction.
+
+        items               (iterable) of (recording, tables) pairs, tables
+                            maps 'headers', 'channels' and 'annotations' to
+                            lists of rows ordered as the *_COLUMNS lists
+        '''
+        with self.conn:
+            for recording, tables in items:
+                for table, columns in TABLES.items():
+                    self.conn.execute(
+                        'DELETE FROM %s WHERE recording = ?' % table,
+                        (recording, ))
+                    self.conn.executemany(
+                        'INSERT INTO %s VALUES (?%s)' %
+                        (table, ', ?' * len(columns)),
+                        [(recording, ) + tuple(_sqlvalue(v) for v in row)
+                         for row in tables.get(table, [])])
+
+    def put(self, recording, headers=(), channels=(), annotations=()):
+        self.put_many([(recording, {'headers': headers,
+                                    'channels': channels,
+                                    'annotations': annotations})])
+
+    def recordings(self):
+        cursor = self.conn.execute(
+            'SELECT DISTINCT recording FROM headers ORDER BY recording')
+        return [row[0] for row in cursor]
+
+    def __contains__(self, recording):
+        cursor = self.conn.execute(
+            'SELECT 1 FROM headers WHERE recording = ? LIMIT 1', (recording, ))
+        return cursor.fetchone() is not None
+
+    def read(self, table, recording=None):
+        '''
+        Return `table` as a DataFrame with the CSV column names, for one
+        recording or, with a 'recording' column, for all of them.
+        '''
+        if table not in TABLES:
+            raise ValueError('unknown metadata table %r' % (table, ))
+        if recording is None:
+            return pd.read_sql_query('SELECT * FROM %s' % table, self.conn)
+        df = pd.read_sql_query(
+            'SELECT * FROM %s WHERE recording = ? ORDER BY rowid' % table,
+            self.conn, params=(recording, ))
+        return df.drop('recording', axis=1)
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.conn, params=params)
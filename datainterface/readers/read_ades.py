@@ -1,6 +1,20 @@
 import numpy as np
 import os
+import re
+import time
 import pandas as pd
+try:
+    from .cache import LRUCache
+    from . import batchconvert
+    from .read_eeg import channel_indices, sample_range
+    from .metastore import (MetaStore, METASTORE_NAME, HEADER_COLUMNS,
+                            CHANNEL_COLUMNS, ANNOTATION_COLUMNS)
+except (ImportError, ValueError):
+    from cache import LRUCache
+    import batchconvert
+    from read_eeg import channel_indices, sample_range
+    from metastore import (MetaStore, METASTORE_NAME, HEADER_COLUMNS,
+                           CHANNEL_COLUMNS, ANNOTATION_COLUMNS)
 '''
 Takes in a pair file of .ades and .dat and extracts the channel names and the corresponding SEEG time series
 
@@ -13,6 +27,10 @@ places them into four different files
 
 Which follows format that we place data from .edf files. Most data is empty since .ades does not get alot of these
 data points.
+
+The batch converter (__main__) writes the raw numpy per recording and the
+header, channel and annotation tables of all recordings into a single
+metadata.sqlite store in the output directory instead of the csv files.
 '''
 
 
@@ -22,40 +40,64 @@ def rawtonumpy(raweeg, outputdatafile):
     np.save(npfile, raweeg)
 
 
-def chantocsv(chanlabels, samplerate, numsamps, outputchanfile):
-    ##################### 2. Import channel headers ########################
-    # create list with dataframe column channel header names
-    channelheaders = [[
-        'Channel Number',
-        'Labels',
-        'Physical Maximum',
-        'Physical Minimum',
-        'Digital Maximum',
-        'Digital Minimum',
-        'Sample Frequency',
-        'Num Samples',
-        'Physical Dimensions',
-    ]]
-
+def chanrows(chanlabels, samplerate, numsamps):
+    '''
+    Rows of the channel table, ordered as metastore.CHANNEL_COLUMNS.
+    '''
     # get the channel labels of file and convert to list of strings
     # -> also gets rid of excessive characters
     chanlabels = [str(x).replace('POL', '').replace(' ', '')
                   for x in chanlabels]
 
-    # read chan header data from each chan for each column and append to list
-    for i in range(len(chanlabels)):
-        channelheaders.append([
-            i + 1,
-            chanlabels[i],
-            '',
-            '',
-            '',
-            '',
-            samplerate,
-            numsamps,
-            '',
-        ])
+    # channel header data of each chan, most of it absent from .ades
+    return [[i + 1, label, '', '', '', '', samplerate, numsamps, '']
+            for i, label in enumerate(chanlabels)]
+
+
+def headerrows(samplerate, numsamps):
+    '''
+    Rows of the file header table, ordered as metastore.HEADER_COLUMNS.
+    '''
+    # startdate = str(edffile.getStartdatetime().day) + '-' + str(edffile.getStartdatetime().month) + '-' + str(edffile.getStartdatetime().year)
+    # starttime = str(edffile.getStartdatetime().hour) + '-' + str(edffile.getStartdatetime().minute) + '-' + str(edffile.getStartdatetime().second)
+    return [[
+        '',
+        '',
+        '',
+        '',
+        '',
+        '',
+        '',
+        numsamps / float(samplerate),
+        '',
+        '',
+        samplerate,
+        numsamps,
+        '',
+    ]]
+
+
+def annotationrows():
+    '''
+    Rows of the annotation table; .ades files carry no annotations.
+    '''
+    return []
+
+
+def metadatarows(header):
+    '''
+    The 'headers', 'channels' and 'annotations' tables of an AdesHeader, as
+    written to a metastore.MetaStore.
+    '''
+    return {'headers': headerrows(header.srate, header.nsamp),
+            'channels': chanrows(header.channels, header.srate, header.nsamp),
+            'annotations': annotationrows()}
 
+
+def chantocsv(chanlabels, samplerate, numsamps, outputchanfile):
+    ##################### 2. Import channel headers ########################
+    channelheaders = [CHANNEL_COLUMNS] + chanrows(chanlabels, samplerate,
+                                                  numsamps)
     # create CSV file of channel header names and data
     channelheaders_df = pd.DataFrame(data=channelheaders)
     # create CSV file of file header names and data
@@ -64,20 +106,7 @@ def chantocsv(chanlabels, samplerate, numsamps, outputchanfile):
 
 def annotationtocsv(outputannotationsfile):
     ##################### 3. Import File Annotations ########################
-    # create list
-    annotationheaders = [[
-        'Time (sec)',
-        'Duration',
-        'Description'
-    ]]
-
-    for n in np.arange(0):
-        annotationheaders.append([
-            '',
-            '',
-            ''
-        ])
-
+    annotationheaders = [ANNOTATION_COLUMNS] + annotationrows()
     annotationheaders_df = pd.DataFrame(data=annotationheaders)
     # create CSV file of channel header names and data
     annotationheaders_df.to_csv(
@@ -87,136 +116,396 @@ def annotationtocsv(outputannotationsfile):
 
 
 def headerstocsv(samplerate, numsamps, outputheadersfile):
-    # create list with dataframe column file header names
-    fileheaders = [[
-        'pyedfib Version',
-        'Birth Date',
-        'Gender',
-        'Start Date (D-M-Y)',
-        'Start Time (H-M-S)',
-        'Patient Code',
-        'Equipment',
-        'Data Record Duration (s)',
-        'Number of Data Records in File',
-        'Number of Annotations in File',
-        'Sample Frequency',
-        'Samples in File',
-        'Physical Dimension'
-    ]]
-
-    # append file header data for each dataframe column to list
-    # startdate = str(edffile.getStartdatetime().day) + '-' + str(edffile.getStartdatetime().month) + '-' + str(edffile.getStartdatetime().year)
-    # starttime = str(edffile.getStartdatetime().hour) + '-' + str(edffile.getStartdatetime().minute) + '-' + str(edffile.getStartdatetime().second)
-
-    fileheaders.append([
-        '',
-        '',
-        '',
-        '',
-        '',
-        '',
-        '',
-        numsamps / float(samplerate),
-        '',
-        '',
-        samplerate,
-        numsamps,
-        '',
-    ])
     # create dataframes from array of meta data
+    fileheaders = [HEADER_COLUMNS] + headerrows(samplerate, numsamps)
     fileheaders_df = pd.DataFrame(data=fileheaders)
     fileheaders_df.to_csv(outputheadersfile, index=False, header=False)
 
 
-def read_ades(fname):
-    dat_fname = fname.split('.ades')[0] + '.dat'
-    srate = None
-    nsamp = None
-    sensors = []
-    with open(fname, 'r') as fd:
-        for line in fd.readlines():
-            if line.startswith('#'):
+class AdesHeader(object):
+    '''
+    Metadata of an ADES recording, parsed from its .ades header and the
+    optional <fname>.bad file listing one bad channel per line.
+
+    srate               (float) sampling rate in Hz
+    nsamp               (int) number of samples announced by the header
+    channels            (list) channel names in the column order of the .dat
+    chtypes             (list) channel types, e.g. 'SEEG', or '' when absent
+    bad_channels        (list) channel names listed in the .bad file
+    seeg_idxs           (list) columns of the good SEEG channels
+    contacts            (list) (electrode, number) tuple of each seeg_idxs
+
+    With require_nsamp=False a missing or zero numberOfSamples is accepted,
+    as in the header of a recording that has just started.
+    '''
+
+    def __init__(self, fname, require_nsamp=True):
+        self.fname = fname
+        self.srate = None
+        self.nsamp = None
+        self.channels = []
+        self.chtypes = []
+        self.bad_channels = []
+        bad_fname = fname + '.bad'
+        if os.path.isfile(bad_fname):
+            with open(bad_fname, 'r') as fd:
+                self.bad_channels = [ch.strip() for ch in fd.readlines()
+                                     if ch.strip() != '']
+
+        with open(fname, 'r') as fd:
+            for line in fd.readlines():
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                # 'lhs = rhs', older files may only separate by spaces
+                if '=' in line:
+                    lhs, rhs = [p.strip() for p in line.split('=', 1)]
+                else:
+                    parts = line.split()
+                    lhs, rhs = parts[0], ' '.join(parts[1:])
+
+                if lhs == 'samplingRate':
+                    self.srate = float(rhs)
+                elif lhs == 'numberOfSamples':
+                    self.nsamp = int(float(rhs))
+                elif lhs in ('date', 'time'):
+                    pass
+                else:
+                    self.channels.append(lhs)
+                    self.chtypes.append(rhs)
+        if not self.srate:
+            raise ValueError('no samplingRate in the header %s' % fname)
+        if require_nsamp and not self.nsamp:
+            raise ValueError('no numberOfSamples in the header %s' % fname)
+
+        self.seeg_idxs = []
+        self.contacts = []
+        for i, (name, kind) in enumerate(zip(self.channels, self.chtypes)):
+            if kind != 'SEEG' or name in self.bad_channels:
                 continue
-            # parts = line.strip().split(' ')
-            # lhs = parts[0]
-            # rhs = parts[2]
-
-            try:
-                lhs, _, rhs = line.strip().split(' ')
-            except ValueError:
-                lhs = line.strip().split(' ')
-
-            if lhs == 'samplingRate':
-                srate = float(rhs)
-            elif lhs == 'numberOfSamples':
-                nsamp = float(rhs)
-            elif lhs in ('date', 'time'):
-                pass
+            match = re.match("([A-Za-z]+[']*)([0-9]+)", name)
+            if match is not None:
+                elec, idx = match.groups()
+                self.contacts.append((elec, int(idx)))
+                self.seeg_idxs.append(i)
+
+
+# parsed headers keyed by path and the mtime/size of the header files, so
+# that revisiting an unchanged recording skips parsing
+_header_cache = LRUCache(maxsize=4096)
+
+
+def read_ades_header(fname, require_nsamp=True):
+    '''
+    Parse the header of the ADES recording `fname` into an AdesHeader,
+    reusing the cached result while the .ades and .bad files are unchanged.
+    '''
+    st = os.stat(fname)
+    bad_fname = fname + '.bad'
+    bad_mtime = None
+    if os.path.isfile(bad_fname):
+        bad_mtime = os.stat(bad_fname).st_mtime
+    key = (os.path.abspath(fname), st.st_mtime, st.st_size, bad_mtime,
+           require_nsamp)
+    header = _header_cache.get(key)
+    if header is None:
+        header = AdesHeader(fname, require_nsamp)
+        _header_cache.put(key, header)
+    return header
+
+
+class AdesRecording(object):
+    '''
+    An ADES recording, i.e. the .ades header and the .dat float32 samples
+    multiplexed sample by sample, backed by a read-only np.memmap of shape
+    (nsamp, nchan). Nothing is read until read() materializes a selection.
+    '''
+    # samples transposed per block when copying out a selection
+    block = 4096
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.dat_fname = fname.split('.ades')[0] + '.dat'
+        self.header = read_ades_header(fname)
+        self.srate = self.header.srate
+        self.sensors = self.header.channels
+        self.nsamp = self.header.nsamp
+        nchan = len(self.sensors)
+        self.data = np.memmap(self.dat_fname, dtype=np.float32, mode='r')
+        self.data = self.data[:self.data.size // nchan * nchan].reshape(
+            (-1, nchan))
+        if self.data.shape[0] != self.nsamp:
+            print("!! data.size != nsamples*ncontacts")
+            print("!! %d != %d %d" % (self.data.size, self.nsamp, nchan))
+            print("!! Ignoring nsamples")
+            self.nsamp = self.data.shape[0]
+
+    def channel_indices(self, channels=None):
+        '''
+        Indices of `channels` given by sensor names and/or indices.
+        '''
+        return channel_indices(self.sensors, channels, self.fname)
+
+    def read(self, channels=None, t0=0., t1=None):
+        '''
+        Return samples [t0, t1) seconds of `channels` as a channel-major,
+        C-contiguous float32 (nsel, nsamples) array; only the selected block
+        is read from disk.
+        '''
+        idx = self.channel_indices(channels)
+        i0, i1 = sample_range(t0, t1, self.srate, self.nsamp)
+        return self._read_samples(idx, i0, i1)
+
+    def _read_samples(self, idx, i0, i1):
+        out = np.empty((len(idx), i1 - i0), np.float32)
+        for b0 in range(i0, i1, self.block):
+            b1 = min(b0 + self.block, i1)
+            out[:, b0 - i0:b1 - i0] = self.data[b0:b1, idx].T
+        return out
+
+    def save_npy(self, filename, chunk=65536):
+        '''
+        Write all channels to a channel-major, C-contiguous float32 .npy in
+        one pass over the .dat file, `chunk` samples at a time.
+        '''
+        idx = self.channel_indices()
+        nsamp = self.data.shape[0]
+        batchconvert.save_channel_major_npy(
+            filename,
+            ((i0, self._read_samples(idx, i0, min(i0 + chunk, nsamp)))
+             for i0 in range(0, nsamp, chunk)),
+            len(self.sensors), nsamp, self.data.dtype)
+
+
+class AdesFollower(object):
+    '''
+    Follow an ADES recording whose .dat file is still being appended to.
+
+    Every poll re-stats the .dat file and reads only the samples appended
+    since the last consumed one, returned as channel-major float32 blocks
+    of exactly `blocksize` samples; an incomplete trailing block is left for
+    a later poll. The .ades header is re-read whenever it is rewritten.
+
+    channels            channel names and/or indices to keep, None for all
+    start               (int) first sample to yield, None (default) to skip
+                        the samples already on disk
+    '''
+
+    def __init__(self, fname, blocksize=1024, channels=None, start=None):
+        self.fname = fname
+        self.dat_fname = fname.split('.ades')[0] + '.dat'
+        self.blocksize = blocksize
+        self.channels = channels
+        self._update_header()
+        self._fd = open(self.dat_fname, 'rb')
+        self._buff = np.empty((blocksize, self.nchan), np.float32)
+        if start is None:
+            start = self.available()
+        self.consumed = start
+
+    def _update_header(self):
+        try:
+            # the sample count comes from the size of the .dat file
+            header = read_ades_header(self.fname, require_nsamp=False)
+        except (ValueError, IndexError, IOError):
+            # caught the header half rewritten, keep the previous one
+            if not hasattr(self, 'header'):
+                raise
+            return
+        if getattr(self, 'header', None) is header:
+            return
+        if hasattr(self, 'nchan') and len(header.channels) != self.nchan:
+            raise ValueError('number of channels of %s changed from %d to %d'
+                             % (self.fname, self.nchan, len(header.channels)))
+        self.header = header
+        self.srate = header.srate
+        self.sensors = header.channels
+        self.nchan = len(header.channels)
+        self.idx = channel_indices(self.sensors, self.channels, self.fname)
+
+    def available(self):
+        '''
+        Number of complete samples currently in the .dat file.
+        '''
+        return os.fstat(self._fd.fileno()).st_size // (self.nchan * 4)
+
+    def poll(self):
+        '''
+        Yield (block, i0) for every complete block appended since the last
+        poll, i0 being the index of the block's first sample. Blocks are
+        read one at a time as they are consumed, so catching up on a long
+        backlog does not hold it all in memory.
+        '''
+        self._update_header()
+        nsamp = self.available()
+        if nsamp < self.consumed:
+            raise IOError('%s was truncated' % self.dat_fname)
+        rowbytes = self.nchan * 4
+        while nsamp - self.consumed >= self.blocksize:
+            self._fd.seek(self.consumed * rowbytes)
+            self._fd.readinto(self._buff)
+            i0 = self.consumed
+            self.consumed += self.blocksize
+            yield self._buff[:, self.idx].T.copy(), i0
+
+    def follow(self, interval=1., timeout=None):
+        '''
+        Yield (block, i0) as blocks are appended, polling every `interval`
+        seconds; stops once no new block arrived for `timeout` seconds.
+        '''
+        last = time.time()
+        while True:
+            got = False
+            for block in self.poll():
+                got = True
+                yield block
+            if got:
+                last = time.time()
+            elif timeout is not None and time.time() - last >= timeout:
+                return
             else:
-                if isinstance(lhs, list):
-                    lhs = lhs[0]
-                sensors.append(lhs)
-    assert srate and nsamp
-    dat = np.fromfile(
-        dat_fname, dtype=np.float32).reshape(
-        (-1, len(sensors))).T
-    return srate, sensors, dat, nsamp
+                time.sleep(interval)
 
+    def close(self):
+        self._fd.close()
 
-if __name__ == '__main__':
-    filename = './id004_cv_sz1.ades'
-
-    # set all directories
-    root_dir = os.path.join('/Users/adam2392/Downloads/')
-    outputdir = '/Users/adam2392/Downloads/converted'
-    # root_dir = os.path.join('/Volumes/ADAM LI/pydata/tvbforwardsim/')
 
-    patient = 'id004_cv'
-    patient = 'id015_sf'
-    # patient = 'id001_ac'
-
-    datadir = os.path.join(root_dir, patient)
-    # Get ALL datafiles from all downstream files
+def read_ades(fname):
+    rec = AdesRecording(fname)
+    return rec.srate, rec.sensors, rec.read(), rec.nsamp
+
+
+def recording_name(patient, idx):
+    '''
+    Name of the idx-th recording of `patient`, used for its output directory
+    and as its key in the metadata store.
+    '''
+    return patient.lower() + '_sz' + str(idx)
+
+
+def recording_outputs(outputdir, patient, idx):
+    '''
+    Output files of the idx-th recording of `patient`.
+    '''
+    name = recording_name(patient, idx)
+    base = os.path.join(outputdir, name, name)
+    return {
+        'npy': base + '_rawnpy.npy',
+    }
+
+
+def find_recordings(datadir):
+    '''
+    All .ades files below `datadir`, sorted so that the recording numbering
+    of the outputs is stable between runs.
+    '''
     datafiles = []
     for root, dirs, files in os.walk(datadir):
         for file in files:
-            if '.DS' not in file and '.ades' in file:
+            if '.DS' not in file and file.endswith('.ades'):
                 datafiles.append(os.path.join(root, file))
-    print(len(datafiles))
-
-    def patdir(idx): return patient.lower() + '_sz' + str(idx)
-
-    for idx, filename in enumerate(datafiles):
-        print(idx, filename)
-
-        srate, sensors, dat, nsamp = read_ades(filename)
-
-        if not os.path.exists(os.path.join(outputdir, patdir(idx))):
-            os.makedirs(os.path.join(outputdir, patdir(idx)))
-
-        # 1. setting filename
-        npyfile = os.path.join(
-            outputdir,
-            patdir(idx),
-            patdir(idx) +
-            '_rawnpy.npy')
-        chanfile = os.path.join(
-            outputdir,
-            patdir(idx),
-            patdir(idx) +
-            '_chans.csv')
-        headerfile = os.path.join(
-            outputdir,
-            patdir(idx),
-            patdir(idx) +
-            '_headers.csv')
-        annotationsfile = os.path.join(
-            outputdir,
-            patdir(idx),
-            patdir(idx) +
-            '_annotations.csv')
-
-        rawtonumpy(dat, npyfile)
-        chantocsv(sensors, srate, nsamp, chanfile)
-        headerstocsv(srate, nsamp, headerfile)
-        annotationtocsv(annotationsfile)
+    return sorted(datafiles)
+
+
+def manifest_path(outputdir, patient):
+    '''
+    Conversion log of `patient`, a batchconvert.Manifest recording the
+    source of every output so that renumbered recordings are converted.
+    '''
+    return os.path.join(outputdir, patient.lower() + '_manifest.jsonl')
+
+
+def _dat_name(fname):
+    return fname.split('.ades')[0] + '.dat'
+
+
+def is_up_to_date(manifest, fname, outputs):
+    '''
+    True when `manifest` records every output as converted from this very
+    .ades, and its .dat, with the same size and mtime as now.
+    '''
+    return all(manifest.is_done(fname, output) and
+               batchconvert.is_unchanged(manifest.records[output],
+                                         _dat_name(fname), 'dat_')
+               for output in outputs.values())
+
+
+def convert_recording(fname, output):
+    rec = AdesRecording(fname)
+    outdir = os.path.dirname(output)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    rec.save_npy(output)
+
+
+def convert_patient(job):
+    '''
+    Convert every recording of one patient directory, skipping those whose
+    outputs are up to date. Returns (patient, stats) with one dict per
+    recording giving its status, the .dat bytes read, the duration and the
+    metadata tables to store under its name. The tables are returned rather
+    than written so that only the parent process writes the store.
+    '''
+    rootdir, outputdir, patient = job
+    if not os.path.exists(outputdir):
+        os.makedirs(outputdir)
+    manifest = batchconvert.Manifest(manifest_path(outputdir, patient))
+    stats = []
+    for idx, fname in enumerate(find_recordings(os.path.join(rootdir, patient))):
+        outputs = recording_outputs(outputdir, patient, idx)
+        if is_up_to_date(manifest, fname, outputs):
+            rec = dict(source=fname, status='skipped', nbytes=0, duration=0.)
+        else:
+            dat = batchconvert.source_stamp(_dat_name(fname), 'dat_')
+            rec = batchconvert.convert_record(convert_recording, fname,
+                                              outputs['npy'])
+            rec.update(dat)
+            manifest.add(rec)
+            rec['nbytes'] = dat['dat_size'] if rec['status'] == 'done' else 0
+        rec['recording'] = recording_name(patient, idx)
+        if rec['status'] != 'failed':
+            rec['metadata'] = metadatarows(read_ades_header(fname))
+        stats.append(rec)
+    return patient, stats
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert the ADES recordings of patient directories.')
+    parser.add_argument('rootdir')
+    parser.add_argument('outputdir')
+    parser.add_argument('patients', nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of patients converted concurrently')
+    args = parser.parse_args()
+
+    jobs = [(args.rootdir, args.outputdir, patient)
+            for patient in args.patients]
+    results = []
+    for patient, stats in batchconvert.run_pool(convert_patient, jobs,
+                                                args.jobs):
+        print('%s: %d recordings' % (patient, len(stats)))
+        results.extend(stats)
+
+    # one transaction for the metadata of every recording
+    store = MetaStore(os.path.join(args.outputdir, METASTORE_NAME))
+    store.put_many((rec['recording'], rec['metadata'])
+                   for rec in results if 'metadata' in rec)
+    store.close()
+
+    total_bytes = sum(rec['nbytes'] for rec in results)
+    total_time = sum(rec['duration'] for rec in results)
+    for rec in results:
+        mb = rec['nbytes'] / 2. ** 20
+        if rec['status'] == 'done':
+            print('%-8s %8.1f MB %7.2f s %8.1f MB/s  %s' % (
+                rec['status'], mb, rec['duration'],
+                mb / max(rec['duration'], 1e-9), rec['source']))
+        else:
+            print('%-8s %s %s' % (rec['status'], rec['source'],
+                                  rec.get('error', '')))
+    if total_time > 0:
+        print('converted %.1f MB in %.2f s of worker time, %.1f MB/s' % (
+            total_bytes / 2. ** 20, total_time,
+            total_bytes / 2. ** 20 / total_time))
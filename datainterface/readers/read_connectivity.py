@@ -5,8 +5,28 @@ except ImportError:
     H5PY_SUPPORT = False
 import numpy
 import zipfile
-import scipy.io
+import scipy.io as scipy_io
 import os
+import io
+import bz2
+import sys
+import itertools
+import contextlib
+import scipy.sparse
+import json
+import hashlib
+import tempfile
+import threading
+try:
+    from .batchconvert import (file_checksum, replacing_dir, run_pool,
+                               source_stamp, is_unchanged)
+    from .read_mat import is_mat73
+    from .cache import LRUCache
+except (ImportError, ValueError):
+    from batchconvert import (file_checksum, replacing_dir, run_pool,
+                              source_stamp, is_unchanged)
+    from read_mat import is_mat73
+    from cache import LRUCache
 
 '''
 
@@ -19,10 +39,279 @@ connectivity data and load it so that you can get access to
 - and much more...
 
 '''
+
+
+class ReaderException(Exception):
+    pass
+
+
+def try_get_absolute_path(relative_module, file_suffix):
+    """
+    :param relative_module: python module to be imported. When import of this fails, we will return the file_suffix
+    :param file_suffix: In case this is already an absolute path, return it immediately,
+        otherwise append it after the module path
+    :return: Try to build an absolute path based on a python module and a file-suffix
+    """
+    result_full_path = file_suffix
+
+    if not os.path.isabs(file_suffix):
+
+        try:
+            module_import = __import__(
+                relative_module, globals(), locals(), ["__init__"])
+            result_full_path = os.path.join(
+                os.path.dirname(
+                    module_import.__file__),
+                file_suffix)
+
+        except ImportError:
+            raise ReaderException(
+                "Could not import tvb_data Python module for default data-set!")
+    return result_full_path
+
+
+# bump when the layout of the connectivity cache changes
+CACHE_VERSION = 1
+CACHE_MANIFEST = 'manifest.json'
+
+
+def cache_path(source_path, cache_dir=None, variant=None):
+    '''
+    Location of the binary cache of a connectivity: a <source>.npycache
+    directory next to it, or an entry keyed by its absolute path inside a
+    shared `cache_dir`. Each `variant`, e.g. a sparse load, has its own.
+    '''
+    if cache_dir is None:
+        path = source_path + '.npycache'
+    else:
+        key = hashlib.sha1(os.path.abspath(source_path).encode('utf-8'))
+        path = os.path.join(cache_dir, key.hexdigest())
+    if variant is not None:
+        path += '-' + variant
+    return path
+
+
+def load_cached_connectivity(source_path, cache_dir=None, verify=False,
+                             mmap_mode='c', variant=None):
+    '''
+    Return the cached fields of the connectivity `source_path` memory mapped
+    with `mmap_mode`, or None when there is no cache entry or it was written
+    for another path, size or mtime (or md5 checksum with verify=True).
+    '''
+    path = cache_path(source_path, cache_dir, variant)
+    try:
+        with open(os.path.join(path, CACHE_MANIFEST), 'r') as fd:
+            manifest = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+    if (manifest.get('version') != CACHE_VERSION or
+            not is_unchanged(manifest, source_path)):
+        return None
+    if verify and manifest.get('md5') != file_checksum(source_path):
+        return None
+    return dict((field, numpy.load(os.path.join(path, name),
+                                   mmap_mode=mmap_mode))
+                for field, name in manifest['fields'].items())
+
+
+def save_cached_connectivity(source_path, result, cache_dir=None,
+                             variant=None):
+    '''
+    Write the parsed connectivity `result` as one .npy per field to the
+    cache entry of `source_path`, replacing a stale entry as a whole so
+    arrays already mapped from it are unchanged. Returns the entry path, or
+    None when it cannot be written (e.g. read-only data directory).
+    '''
+    path = cache_path(source_path, cache_dir, variant)
+    manifest = dict(version=CACHE_VERSION, md5=file_checksum(source_path),
+                    fields={})
+    manifest.update(source_stamp(source_path))
+    try:
+        with replacing_dir(path) as tmpdir:
+            for field, value in result.items():
+                value = numpy.asarray(value)
+                if value.dtype == object:
+                    # e.g. variable-length strings from h5py
+                    value = value.astype(str)
+                manifest['fields'][field] = field + '.npy'
+                numpy.save(os.path.join(tmpdir, field + '.npy'), value)
+            with open(os.path.join(tmpdir, CACHE_MANIFEST), 'w') as fd:
+                json.dump(manifest, fd)
+    except (IOError, OSError) as e:
+        sys.stderr.write('could not cache connectivity of %s: %s\n'
+                         % (source_path, e))
+        return None
+    return path
+
+
+# sources reduced at once by FileReader.read_gain_from_brainstorm
+GAIN_BLOCK = 4096
+
+# bytes of arrays kept by the in-process cache of ConnectivityLoader
+CONN_CACHE_BYTES = 1024 * 2 ** 20
+
+# matrices returned as CSR by LoadConn.readsparseconnectivity
+SPARSE_FIELDS = ('weights', 'tract_lengths')
+
+
+def sparse_rows(weights, tract_lengths, threshold=0., topk=None):
+    '''
+    Sparsify a block of rows: keep the entries whose absolute weight is
+    above `threshold`, and of those only the `topk` largest of each row.
+    Returns the entry count of each row, their column indices in increasing
+    order and the matching weights and tract lengths.
+    '''
+    if topk is not None and topk < 1:
+        raise ValueError('topk must be None or at least 1, not %r' % (topk, ))
+    keep = numpy.abs(weights) > threshold
+    if topk is not None and topk < weights.shape[1]:
+        # the topk-th largest weight of each row bounds what is kept
+        kth = -numpy.partition(-numpy.abs(weights), topk - 1, axis=1)[
+            :, topk - 1:topk]
+        keep &= numpy.abs(weights) >= kth
+        # ties at the bound may keep more than topk, drop the last ones
+        excess = numpy.cumsum(keep, axis=1) > topk
+        keep &= ~excess
+    rows, cols = numpy.nonzero(keep)
+    counts = numpy.bincount(rows, minlength=weights.shape[0])
+    return counts, cols, weights[rows, cols], tract_lengths[rows, cols]
+
+
+def _pack_sparse(result):
+    # CSR matrices as their component arrays, for the .npy cache
+    packed = {}
+    for field, value in result.items():
+        if scipy.sparse.issparse(value):
+            packed[field + '.data'] = value.data
+            packed[field + '.indices'] = value.indices
+            packed[field + '.indptr'] = value.indptr
+            packed[field + '.shape'] = numpy.array(value.shape)
+        else:
+            packed[field] = value
+    return packed
+
+
+def _unpack_sparse(packed):
+    result = dict((field, value) for field, value in packed.items()
+                  if '.' not in field)
+    for field in SPARSE_FIELDS:
+        if field + '.data' in packed:
+            result[field] = scipy.sparse.csr_matrix(
+                (packed[field + '.data'], packed[field + '.indices'],
+                 packed[field + '.indptr']),
+                shape=tuple(packed[field + '.shape']), copy=False)
+    return result
+
+
+def _text_blocks(stream, block):
+    # parse a whitespace separated text matrix `block` rows at a time
+    while True:
+        lines = [line for line in itertools.islice(stream, block)
+                 if line.strip()]
+        if not lines:
+            return
+        text = b' '.join(lines).decode('ascii')
+        yield numpy.array(text.split(), numpy.float64).reshape(
+            len(lines), -1)
+
+
 class LoadConn(object):
-    def readconnectivity(self, source_file):
+    def readconnectivity(self, source_file, use_cache=False, cache_dir=None,
+                         verify=False):
+        '''
+        Read a TVB connectivity from a zip of text files or an h5 file.
+
+        With use_cache the parsed fields are kept as .npy files (see
+        cache_path, by default a directory next to the source) and memory
+        mapped on later loads, as long as the source keeps its size and
+        mtime, and md5 checksum with verify. Cached arrays are mapped
+        copy-on-write, so like freshly parsed ones they can be changed in
+        place without touching the cache.
+        '''
+        source_full_path = try_get_absolute_path(
+            "tvb_data.connectivity", source_file)
+        if use_cache:
+            result = load_cached_connectivity(source_full_path, cache_dir,
+                                              verify)
+            if result is not None:
+                return result
+        result = self._parseconnectivity(source_file, source_full_path)
+        if use_cache:
+            save_cached_connectivity(source_full_path, result, cache_dir)
+        return result
+
+    def readsparseconnectivity(self, source_file, threshold=0., topk=None,
+                               use_cache=False, cache_dir=None, verify=False,
+                               block=256):
+        '''
+        Read a connectivity like readconnectivity, with weights and
+        tract_lengths as scipy.sparse CSR matrices of the same sparsity: the
+        entries of weights above `threshold` in absolute value, and only the
+        `topk` largest of each row if given.
+
+        The matrices are built in one pass over `block` rows at a time, so
+        memory scales with the number of edges kept. Results are cached like
+        readconnectivity, one entry per threshold and topk.
+        '''
         source_full_path = try_get_absolute_path(
             "tvb_data.connectivity", source_file)
+        variant = 'sparse-%r-%r' % (float(threshold), topk)
+        if use_cache:
+            packed = load_cached_connectivity(source_full_path, cache_dir,
+                                              verify, variant=variant)
+            if packed is not None:
+                return _unpack_sparse(packed)
+
+        if source_file.endswith(".h5"):
+            with LazyConnectivity(source_full_path) as conn:
+                blocks = ((w, t) for (_, w), (_, t) in zip(
+                    conn.iter_rows('weights', block),
+                    conn.iter_rows('tract_lengths', block)))
+                result = self._sparsematrices(blocks, threshold, topk)
+                result['centres'] = conn.centres[()]
+                for field in ('region_labels', 'orientations', 'cortical',
+                              'hemispheres', 'areas'):
+                    result[field] = getattr(conn, field)
+        else:
+            reader = ZipReader(source_full_path)
+            with reader.member_stream("weights") as wstream, \
+                    reader.member_stream("tract_lengths") as tstream:
+                blocks = zip(_text_blocks(wstream, block),
+                             _text_blocks(tstream, block))
+                result = self._sparsematrices(blocks, threshold, topk)
+            result.update(self._readzip(reader, matrices=False))
+            reader.close()
+
+        if use_cache:
+            save_cached_connectivity(source_full_path, _pack_sparse(result),
+                                     cache_dir, variant=variant)
+        return result
+
+    def _sparsematrices(self, blocks, threshold, topk):
+        counts, indices, weights, tract_lengths = [], [], [], []
+        ncols = 0
+        for wblock, tblock in blocks:
+            ncols = wblock.shape[1]
+            c, i, w, t = sparse_rows(wblock, tblock, threshold, topk)
+            counts.append(c)
+            indices.append(i)
+            weights.append(w)
+            tract_lengths.append(t)
+        counts = numpy.concatenate(counts) if counts else numpy.zeros(0, int)
+        indptr = numpy.concatenate(([0], numpy.cumsum(counts)))
+        indices = numpy.concatenate(indices) if indices else \
+            numpy.zeros(0, int)
+        shape = (len(counts), ncols)
+        return {
+            'weights': scipy.sparse.csr_matrix(
+                (numpy.concatenate(weights) if weights else numpy.zeros(0),
+                 indices, indptr), shape=shape),
+            'tract_lengths': scipy.sparse.csr_matrix(
+                (numpy.concatenate(tract_lengths) if tract_lengths
+                 else numpy.zeros(0), indices, indptr), shape=shape),
+        }
+
+    def _parseconnectivity(self, source_file, source_full_path):
         result = dict()
 
         if source_file.endswith(".h5"):
@@ -40,45 +329,149 @@ class LoadConn(object):
 
         else:
             reader = ZipReader(source_full_path)
+            result = self._readzip(reader)
+            reader.close()
+        return result
 
+    def _readzip(self, reader, matrices=True):
+        result = dict()
+        if matrices:
             result['weights'] = reader.read_array_from_file("weights")
-            result['centres'] = reader.read_array_from_file(
-                "centres", use_cols=(1, 2, 3))
-            result['region_labels'] = reader.read_array_from_file(
-                "centres", dtype=numpy.str, use_cols=(0,))
-            result['orientations'] = reader.read_optional_array_from_file(
-                "average_orientations")
-            result['cortical'] = reader.read_optional_array_from_file(
-                "cortical", dtype=numpy.bool)
-            # result['hemispheres'] = reader.read_optional_array_from_file("hemispheres", dtype=numpy.bool)
-            result['areas'] = reader.read_optional_array_from_file("areas")
-            result['tract_lengths'] = reader.read_array_from_file("tract_lengths")
+        # labels and coordinates share the centres member, parse it once
+        centres = reader.read_array_from_file("centres", dtype=str)
+        result['centres'] = centres[:, 1:4].astype(numpy.float64)
+        result['region_labels'] = centres[:, 0]
+        result['orientations'] = reader.read_optional_array_from_file(
+            "average_orientations")
+        result['cortical'] = reader.read_optional_array_from_file(
+            "cortical", dtype=bool)
+        # result['hemispheres'] = reader.read_optional_array_from_file("hemispheres", dtype=numpy.bool)
+        result['areas'] = reader.read_optional_array_from_file("areas")
+        if matrices:
+            result['tract_lengths'] = reader.read_array_from_file(
+                "tract_lengths")
         return result
 
+    def openconnectivity(self, source_file):
+        '''
+        Open an h5 connectivity as a LazyConnectivity, whose matrices stay
+        on disk until sliced.
+        '''
+        source_full_path = try_get_absolute_path(
+            "tvb_data.connectivity", source_file)
+        if not source_file.endswith(".h5"):
+            raise ReaderException(
+                "Lazy loading needs an h5 connectivity, not %s" % source_file)
+        return LazyConnectivity(source_full_path)
 
-    def try_get_absolute_path(self,relative_module, file_suffix):
-        """
-        :param relative_module: python module to be imported. When import of this fails, we will return the file_suffix
-        :param file_suffix: In case this is already an absolute path, return it immediately,
-            otherwise append it after the module path
-        :return: Try to build an absolute path based on a python module and a file-suffix
-        """
-        result_full_path = file_suffix
+    def try_get_absolute_path(self, relative_module, file_suffix):
+        return try_get_absolute_path(relative_module, file_suffix)
 
-        if not os.path.isabs(file_suffix):
 
-            try:
-                module_import = __import__(
-                    relative_module, globals(), locals(), ["__init__"])
-                result_full_path = os.path.join(
-                    os.path.dirname(
-                        module_import.__file__),
-                    file_suffix)
+class LazyConnectivity(object):
+    """
+    A connectivity h5 file kept open, with weights, tract_lengths and
+    centres left as h5py datasets. Region labels and the other per-region
+    vectors are small and read up front.
 
-            except ImportError:
-                raise exception(
-                    "Could not import tvb_data Python module for default data-set!")
-        return result_full_path
+    Matrices are read a block of rows at a time, so a region subset or a
+    pass over all rows never holds more than `block` full rows in memory.
+    """
+    # rows read from a matrix dataset at once
+    block = 256
+
+    def __init__(self, h5_path):
+        self.reader = H5Reader(h5_path)
+        self.weights = self.reader.get_dataset("weights")
+        self.tract_lengths = self.reader.get_dataset("tract_lengths")
+        self.centres = self.reader.get_dataset("centres")
+        self.region_labels = numpy.asarray(
+            self.reader.read_field("region_labels")).astype(str)
+        self.orientations = self.reader.read_optional_field("orientations")
+        self.cortical = self.reader.read_optional_field("cortical")
+        self.hemispheres = self.reader.read_optional_field("hemispheres")
+        self.areas = self.reader.read_optional_field("areas")
+        self.nregions = self.weights.shape[0]
+        self._labels = dict((label, i) for i, label in
+                            enumerate(self.region_labels))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.reader.close()
+
+    def region_indices(self, regions):
+        '''
+        Indices of `regions` given by labels and/or indices.
+        '''
+        if regions is None:
+            return numpy.arange(self.nregions)
+        if isinstance(regions, (str, int, numpy.integer)):
+            regions = [regions]
+        idx = []
+        for r in regions:
+            if isinstance(r, (int, numpy.integer)):
+                if not -self.nregions <= r < self.nregions:
+                    raise IndexError('region index %d out of range' % r)
+                idx.append(int(r) % self.nregions)
+            elif r in self._labels:
+                idx.append(self._labels[r])
+            else:
+                raise ReaderException("Unknown region %r" % (r, ))
+        return numpy.array(idx, dtype=int)
+
+    def _field(self, field):
+        if isinstance(field, str):
+            return getattr(self, field)
+        return field
+
+    def read_rows(self, field, rows, cols=None):
+        '''
+        Rows `rows` and columns `cols` (labels or indices, None for all) of
+        the matrix `field`, e.g. 'weights', in the order given.
+        '''
+        dataset = self._field(field)
+        rows = self.region_indices(rows)
+        cols = None if cols is None else self.region_indices(cols)
+        ncols = dataset.shape[1] if cols is None else len(cols)
+        out = numpy.empty((len(rows), ncols), dataset.dtype)
+        # h5py selections must be increasing, so read the sorted unique rows
+        # and scatter them back to the requested order
+        uniq, inverse = numpy.unique(rows, return_inverse=True)
+        for b0 in range(0, len(uniq), self.block):
+            sel = uniq[b0:b0 + self.block]
+            if len(sel) == sel[-1] - sel[0] + 1:
+                data = dataset[sel[0]:sel[-1] + 1]
+            else:
+                data = dataset[sel.tolist()]
+            if cols is not None:
+                data = data[:, cols]
+            mask = (inverse >= b0) & (inverse < b0 + len(sel))
+            out[mask] = data[inverse[mask] - b0]
+        return out
+
+    def submatrix(self, field, regions):
+        '''
+        The square block of matrix `field` between `regions`, e.g. the
+        weights between the implanted regions only.
+        '''
+        return self.read_rows(field, regions, regions)
+
+    def iter_rows(self, field, block=None, cols=None):
+        '''
+        Yield (i0, rows) for consecutive blocks of `block` rows of matrix
+        `field`, restricted to the columns `cols` if given.
+        '''
+        dataset = self._field(field)
+        block = block or self.block
+        cols = None if cols is None else self.region_indices(cols)
+        for i0 in range(0, dataset.shape[0], block):
+            data = dataset[i0:i0 + block]
+            yield i0, data if cols is None else data[:, cols]
 
 
 class H5Reader(object):
@@ -90,7 +483,7 @@ class H5Reader(object):
         if H5PY_SUPPORT:
             self.hfd5_source = hdf5.File(h5_path, 'r', libver='latest')
         else:
-            self.logger.warning(
+            raise ReaderException(
                 "You need h5py properly installed in order to load from a HDF5 source.")
 
     def read_field(self, field, ):
@@ -100,6 +493,18 @@ class H5Reader(object):
         except Exception:
             raise ReaderException("Could not read from %s field" % field)
 
+    def get_dataset(self, field):
+        '''
+        The h5py dataset of `field`, nothing is read until it is sliced.
+        '''
+        try:
+            return self.hfd5_source['/' + field]
+        except KeyError:
+            raise ReaderException("Could not find %s field" % field)
+
+    def close(self):
+        self.hfd5_source.close()
+
     def read_optional_field(self, field):
         try:
             return self.read_field(field)
@@ -159,61 +564,202 @@ class FileReader(object):
             matlab_data = scipy_io.matlab.loadmat(file_stream)
             return matlab_data[matlab_data_name]
 
-    def read_gain_from_brainstorm(self):
-
+    def read_gain_from_brainstorm(self, use_cache=False, cache_dir=None,
+                                  block=GAIN_BLOCK):
+        '''
+        The (nsens, nsrc) gain of a Brainstorm head model, i.e. Gain with
+        the 3 columns of each source reduced along GridOrient.
+
+        Sources are reduced `block` at a time straight into the output. With
+        use_cache it is a memory-mapped .npy named after the md5 of the
+        source inside `cache_dir` (the directory of the source by default),
+        so a later call on the same head model only maps the cached result.
+        The md5 of a source is remembered with its size and mtime, so it is
+        only hashed again once it changed, and the gain of its previous
+        content is then deleted. The cached gain is mapped copy-on-write:
+        in-place changes stay in memory and leave the cache intact. MAT-file
+        v7.3 sources are read block by block from their h5py datasets.
+        '''
         if not self.file_path.endswith('.mat'):
             raise ReaderException(
                 "Brainstorm format is expected in a Matlab file not %s" %
                 self.file_path)
 
-        mat = scipy_io.loadmat(self.file_stream)
+        path = None
+        if use_cache:
+            cache_dir = cache_dir or os.path.dirname(
+                os.path.abspath(self.file_path))
+            path = os.path.join(cache_dir, 'gain-%s.npy' %
+                                self._gain_checksum(cache_dir))
+            if os.path.exists(path):
+                return numpy.load(path, mmap_mode='c')
+
         expected_fields = ['Gain', 'GridLoc', 'GridOrient']
+        if is_mat73(self.file_path):
+            h5 = hdf5.File(self.file_path, 'r')
+            mat = dict((field, h5[field]) for field in expected_fields
+                       if field in h5)
+            # MATLAB is column-major: Gain is stored as (3 * nsrc, nsens)
+            nsrc3, nsens = mat['Gain'].shape if 'Gain' in mat else (0, 0)
+        else:
+            h5 = None
+            mat = scipy_io.loadmat(self.file_stream,
+                                   variable_names=expected_fields)
+            nsens, nsrc3 = mat['Gain'].shape if 'Gain' in mat else (0, 0)
 
         for field in expected_fields:
             if field not in mat.keys():
+                if h5 is not None:
+                    h5.close()
                 raise ReaderException(
                     "Brainstorm format is expecting field %s" %
                     field)
 
-        gain, loc, ori = (mat[field] for field in expected_fields)
-        return (gain.reshape((gain.shape[0], -1, 3)) * ori).sum(axis=-1)
+        gain, ori = mat['Gain'], mat['GridOrient']
+        ori = ori[()].T if h5 is not None else ori
+        nsrc = nsrc3 // 3
+
+        out = tmp = None
+        if path is not None:
+            try:
+                # unique per writer, as other processes may compute it too
+                fd, tmp = tempfile.mkstemp(suffix='.tmp',
+                                           prefix=os.path.basename(path),
+                                           dir=os.path.dirname(path))
+                os.close(fd)
+                out = numpy.lib.format.open_memmap(
+                    tmp, 'w+', numpy.float64, (nsens, nsrc))
+            except (IOError, OSError) as e:
+                sys.stderr.write('could not cache gain of %s: %s\n'
+                                 % (self.file_path, e))
+                path = None
+        if out is None:
+            out = numpy.empty((nsens, nsrc), numpy.float64)
+
+        try:
+            for j0 in range(0, nsrc, block):
+                j1 = min(j0 + block, nsrc)
+                if h5 is not None:
+                    g = gain[3 * j0:3 * j1].reshape((j1 - j0, 3, nsens))
+                    out[:, j0:j1] = numpy.einsum('jks,jk->sj', g, ori[j0:j1])
+                else:
+                    g = gain[:, 3 * j0:3 * j1].reshape((nsens, j1 - j0, 3))
+                    out[:, j0:j1] = numpy.einsum('sjk,jk->sj', g, ori[j0:j1])
+        except BaseException:
+            if tmp is not None and os.path.exists(tmp):
+                del out
+                os.remove(tmp)
+            raise
+        finally:
+            if h5 is not None:
+                h5.close()
+
+        if path is None:
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+            return out
+        out.flush()
+        del out
+        os.replace(tmp, path)
+        return numpy.load(path, mmap_mode='c')
+
+    def _gain_checksum(self, cache_dir):
+        # md5 of the source, hashed only when its size or mtime changed
+        stamp = source_stamp(self.file_path)
+        index = os.path.join(cache_dir, 'gain-%s.json' % hashlib.sha1(
+            stamp['path'].encode('utf-8')).hexdigest())
+        entry = {}
+        try:
+            with open(index, 'r') as fd:
+                entry = json.load(fd)
+            if is_unchanged(entry, self.file_path):
+                return entry['md5']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        md5 = file_checksum(self.file_path)
+        if entry.get('md5') not in (None, md5):
+            # the source changed, drop the gain of its previous content
+            try:
+                os.remove(os.path.join(cache_dir,
+                                       'gain-%s.npy' % entry['md5']))
+            except OSError:
+                pass
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(stamp, md5=md5), f)
+            os.replace(tmp, index)
+        except (IOError, OSError):
+            pass
+        return md5
 
 
 class ZipReader(object):
     """
     Read one or many numpy arrays from a ZIP archive.
+
+    The archive is opened once and its members indexed by name without
+    extensions, e.g. 'weights' for 'connectivity/weights.txt.bz2'. Members
+    are parsed straight from the archive, .bz2 ones decompressed on the fly.
     """
 
     def __init__(self, zip_path):
         self.zip_archive = zipfile.ZipFile(zip_path)
-
-    def read_array_from_file(self, file_name, dtype=numpy.float64,
-                             skip_rows=0, use_cols=None, matlab_data_name=None):
-
-        matching_file_name = None
-        for actual_name in self.zip_archive.namelist():
-            if file_name in actual_name and not actual_name.startswith(
-                    "__MACOSX"):
-                matching_file_name = actual_name
-                break
+        self.members = self.zip_archive.namelist()
+        self._index = {}
+        for actual_name in self.members:
+            if actual_name.startswith("__MACOSX") or actual_name.endswith("/"):
+                continue
+            stem = os.path.basename(actual_name).split('.')[0]
+            self._index.setdefault(stem, actual_name)
+
+    def close(self):
+        self.zip_archive.close()
+
+    def find_member(self, file_name):
+        if file_name not in self._index:
+            # not a member name, fall back to the first member containing it
+            self._index[file_name] = None
+            for actual_name in self.members:
+                if file_name in actual_name and not actual_name.startswith(
+                        "__MACOSX"):
+                    self._index[file_name] = actual_name
+                    break
+        return self._index[file_name]
+
+    @contextlib.contextmanager
+    def member_stream(self, file_name):
+        '''
+        Binary stream of the member matching `file_name`, decompressed on
+        the fly for .bz2 members.
+        '''
+        matching_file_name = self.find_member(file_name)
 
         if matching_file_name is None:
             raise ReaderException("File %r not found in ZIP." % file_name)
 
         zip_entry = self.zip_archive.open(matching_file_name, 'r')
-
+        stream = zip_entry
         if matching_file_name.endswith(".bz2"):
-            temp_file = copy_zip_entry_into_temp(zip_entry, matching_file_name)
-            file_reader = FileReader(temp_file)
-            result = file_reader.read_array(
-                dtype, skip_rows, use_cols, matlab_data_name)
-            os.remove(temp_file)
-            return result
+            try:
+                stream = bz2.BZ2File(zip_entry)
+            except TypeError:
+                # python 2 BZ2File only takes file names
+                stream = io.BytesIO(bz2.decompress(zip_entry.read()))
+        try:
+            yield stream
+        finally:
+            stream.close()
+            zip_entry.close()
+
+    def read_array_from_file(self, file_name, dtype=numpy.float64,
+                             skip_rows=0, use_cols=None, matlab_data_name=None):
 
-        file_reader = FileReader(matching_file_name)
-        file_reader.file_stream = zip_entry
-        return file_reader.read_array(
-            dtype, skip_rows, use_cols, matlab_data_name)
+        with self.member_stream(file_name) as stream:
+            file_reader = FileReader(self.find_member(file_name))
+            file_reader.file_stream = stream
+            return file_reader.read_array(
+                dtype, skip_rows, use_cols, matlab_data_name)
 
     def read_optional_array_from_file(self, file_name, dtype=numpy.float64, skip_rows=0,
                                       use_cols=None, matlab_data_name=None):
@@ -222,3 +768,126 @@ class ZipReader(object):
                 file_name, dtype, skip_rows, use_cols, matlab_data_name)
         except ReaderException:
             return numpy.array([])
+
+
+def _nbytes(result):
+    return sum(value.nbytes for value in result.values()
+               if isinstance(value, numpy.ndarray))
+
+
+# parsed connectivities shared by every ConnectivityLoader of the process
+_conn_cache = LRUCache(maxsize=None, maxbytes=CONN_CACHE_BYTES,
+                       sizeof=_nbytes)
+
+# connectivities being parsed, keyed by cache and path, so that threads
+# missing the same one wait for the first instead of parsing it again
+_loading = {}
+_loading_lock = threading.Lock()
+
+
+class _Loading(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ConnectivityLoader(object):
+    """
+    Load the connectivities of many patients on a pool of threads.
+
+    Parsed connectivities are kept in an LRU cache shared by all loaders of
+    the process, keyed by path, size and mtime and bounded by `maxbytes`
+    of arrays, so every caller gets the same read-only arrays. Misses go
+    through LoadConn.readconnectivity, and its .npy disk cache with
+    use_cache.
+
+    A connectivity is parsed once even when several threads miss it at
+    the same time: the others wait for the first and count as hits. hits
+    and misses count lookups in the in-process cache, bytes_loaded the
+    array bytes parsed or mapped from disk by this loader.
+    """
+
+    def __init__(self, workers=4, use_cache=False, cache_dir=None,
+                 cache=None):
+        self.workers = workers
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.cache = _conn_cache if cache is None else cache
+        self.hits = 0
+        self.misses = 0
+        self.bytes_loaded = 0
+        self._lock = threading.Lock()
+
+    def _key(self, source_full_path):
+        stamp = source_stamp(source_full_path)
+        return (stamp['path'], stamp['size'], stamp['mtime'])
+
+    def load(self, source_file):
+        '''
+        The connectivity of `source_file` as a dict of read-only arrays.
+        '''
+        key = self._key(try_get_absolute_path(
+            "tvb_data.connectivity", source_file))
+        with _loading_lock:
+            result = self.cache.get(key)
+            loading = _loading.get((id(self.cache), key))
+            first = result is None and loading is None
+            if first:
+                loading = _loading[(id(self.cache), key)] = _Loading()
+        if result is None and not first:
+            loading.done.wait()
+            if loading.error is not None:
+                raise loading.error
+            result = loading.result
+        if not first:
+            with self._lock:
+                self.hits += 1
+            return result
+
+        try:
+            result = LoadConn().readconnectivity(
+                source_file, use_cache=self.use_cache,
+                cache_dir=self.cache_dir)
+            for value in result.values():
+                if isinstance(value, numpy.ndarray):
+                    value.flags.writeable = False
+            with self._lock:
+                self.misses += 1
+                self.bytes_loaded += _nbytes(result)
+            self.cache.put(key, result)
+            loading.result = result
+        except Exception as e:
+            loading.error = e
+            raise
+        finally:
+            with _loading_lock:
+                del _loading[(id(self.cache), key)]
+            loading.done.set()
+        return result
+
+    def load_many(self, sources):
+        '''
+        Load every connectivity of `sources`, a dict of patient to file or a
+        list of files, and yield (patient or file, result, error) as each
+        one finishes; error is None on success and a message otherwise.
+        '''
+        if not isinstance(sources, dict):
+            sources = dict((source, source) for source in sources)
+
+        def load(item):
+            name, source_file = item
+            try:
+                return name, self.load(source_file), None
+            except Exception as e:
+                return name, None, '%s: %s' % (type(e).__name__, e)
+
+        for result in run_pool(load, sorted(sources.items()), self.workers,
+                               threads=True):
+            yield result
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    bytes_loaded=self.bytes_loaded,
+                    cached_entries=len(self.cache),
+                    cached_bytes=self.cache.nbytes)
@@ -3,8 +3,16 @@
 from __future__ import print_function, division
 import os
 import sys
+import json
+import glob
+import time
+import hashlib
 import numpy as np
 import scipy.io
+try:
+    from . import batchconvert
+except (ImportError, ValueError):
+    import batchconvert
 
 MAXELEC = 1024
 OLDMAXELEC = 128
@@ -121,6 +129,15 @@ frequencyGroup = np.dtype([
     ('totalNbChannels', 'H'),
     ('NbUsedChannels', 'H')
 ])
+marker = np.dtype([
+    ('sample', 'I'),
+    ('code', 'H'),
+])
+event = np.dtype([
+    ('sample', 'i8'),
+    ('time', 'f8'),
+    ('code', 'i4'),
+])
 cbmap = {
     0xCAFD0300: 'skip',
     0xCAFD0301: 'infoPatient',
@@ -135,31 +152,279 @@ cbmap = {
     0xCAFD0201: 'read markers',
     0xCAFDCAFD: 'end',
 }
+# header fields kept in the index, bump INDEX_VERSION when changing them
+INDEX_VERSION = 3
+INDEX_FIELDS = ('data_offset', 'nsamp', 'nchan', 'srate', 'chnm',
+                'chscale', 'chkind', 'patient', 'events', 'file_nbrs')
+# raw header records set by parsing the header, which the index skips
+RAW_HEADER_FIELDS = ('ident', 'hdr', 'ip', 'im', 'desc', 'markers')
+# file name suffix of each bulk conversion format
+OUTPUT_SUFFIX = {
+    'mat': '.mat',
+    'npy': '.npy',
+    'fif': '_raw.fif',
+}
+# samples decoded per block when converting to physical units
+CONVERT_BLOCK = 1024
+# seconds of data held in memory at once by the streaming exports
+EXPORT_CHUNK = 10.
 
 
 def uncrypt(buff):
     _ = np.frombuffer(buff, dtype=np.int8).copy()
     _[:-1] ^= _[1:] ^ np.r_[1:len(buff)]
-    return _.tostring()
+    return _.tobytes()
+
+
+def mat73_header():
+    '''
+    The 128 byte text header MATLAB expects in the HDF5 userblock of a
+    v7.3 MAT-file.
+    '''
+    text = ('MATLAB 7.3 MAT-file, Platform: %s, Created on: %s '
+            'HDF5 schema 1.00 .' % (sys.platform,
+                                    time.strftime('%a %b %d %H:%M:%S %Y')))
+    return text.ljust(116).encode('ascii') + b'\x00' * 8 + b'\x00\x02IM'
+
+
+def _micromed_raw(eeg):
+    '''
+    Wrap `eeg` in an mne Raw that decodes samples on demand, so that saving
+    it to FIF streams through the recording buffer by buffer.
+    '''
+    import mne
+    try:
+        from mne.io import BaseRaw
+    except ImportError:
+        from mne.io.base import _BaseRaw as BaseRaw
+
+    class RawMicromed(BaseRaw):
+        def __init__(self):
+            info = mne.create_info(eeg.chnm, eeg.srate,
+                                   ['eeg' for _ in eeg.chnm])
+            super(RawMicromed, self).__init__(
+                info, preload=False, last_samps=[int(eeg.nsamp) - 1],
+                filenames=[eeg.filename], orig_format='single')
+
+        def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+            with open(eeg.filename, 'rb') as fd:
+                if mult is None:
+                    eeg._read_samples(fd, start, stop, idx, out=data)
+                    data *= cals
+                else:
+                    one = eeg._read_samples(fd, start, stop, dtype=data.dtype)
+                    data[:] = np.dot(mult, one[idx])
+
+    return RawMicromed()
+
+
+def sample_range(t0, t1, srate, nsamp):
+    '''
+    Convert a (t0, t1) window in seconds into a [i0, i1) range of sample
+    indices clamped to [0, nsamp]; t1=None runs to the end.
+    '''
+    nsamp = int(nsamp)
+    i0 = min(max(int(t0 * srate), 0), nsamp)
+    if t1 is None:
+        i1 = nsamp
+    else:
+        i1 = min(max(int(t1 * srate), i0), nsamp)
+    return i0, i1
+
+
+def channel_indices(names, channels=None, source=None):
+    '''
+    Indices into the channel list `names` of `channels` given by names
+    and/or indices, negative ones counting from the end; None for all.
+    `source` names the recording in the error of an unknown channel.
+    '''
+    nchan = len(names)
+    if channels is None:
+        return np.arange(nchan)
+    if isinstance(channels, (str, int, np.integer)):
+        channels = [channels]
+    idx = []
+    for c in channels:
+        if isinstance(c, (int, np.integer)):
+            if not -nchan <= c < nchan:
+                raise IndexError('channel index %d out of range' % c)
+            idx.append(int(c) % nchan)
+        elif c in names:
+            idx.append(names.index(c))
+        else:
+            raise ValueError('no channel named %r in %r' % (c, source))
+    return np.array(idx, dtype=int)
+
+
+def event_table(samples, codes, srate):
+    '''
+    Build the columnar event table (sample, time, code) sorted by sample.
+    '''
+    events = np.empty(len(samples), event)
+    events['sample'] = samples
+    events['time'] = events['sample'] / srate
+    events['code'] = codes
+    return np.sort(events, order='sample', kind='mergesort')
+
+
+def index_path(filename, index_dir=None):
+    '''
+    Location of the header index of `filename`: a sidecar next to the file,
+    or an entry keyed by its absolute path inside a shared `index_dir`.
+    '''
+    if index_dir is None:
+        return filename + '.hdr.json'
+    key = hashlib.sha1(os.path.abspath(filename).encode('utf-8'))
+    return os.path.join(index_dir, key.hexdigest() + '.json')
+
+
+def load_header_index(filename, index_dir=None):
+    '''
+    Return the indexed header fields of `filename`, or None when there is no
+    index entry or it was written for another path, size or mtime.
+    '''
+    try:
+        with open(index_path(filename, index_dir), 'r') as fd:
+            index = json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+    if (index.get('version') != INDEX_VERSION or
+            not batchconvert.is_unchanged(index, filename)):
+        return None
+    index['chscale'] = np.array(index['chscale'])
+    index['events'] = event_table(index['events']['sample'],
+                                  index['events']['code'], index['srate'])
+    index['file_nbrs'] = tuple(index['file_nbrs'])
+    return index
+
+
+def save_header_index(filename, fields, index_dir=None):
+    '''
+    Write the header `fields` of `filename` to its index entry. Returns the
+    index path, or None when it cannot be written (e.g. read-only archive).
+    '''
+    index = dict(fields)
+    index.update(batchconvert.source_stamp(filename), version=INDEX_VERSION)
+    index['nsamp'] = float(index['nsamp'])
+    index['srate'] = float(index['srate'])
+    index['chscale'] = [float(s) for s in index['chscale']]
+    index['events'] = {'sample': index['events']['sample'].tolist(),
+                       'code': index['events']['code'].tolist()}
+    path = index_path(filename, index_dir)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp, 'w') as fd:
+            json.dump(index, fd)
+        os.replace(tmp, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+    return path
+
+
+class ScaledMemmap(object):
+    '''
+    Read-only view over the int16 data block of a Micromed file.
+
+    The samples stay on disk in a (nsamp, nchan) np.memmap shared through
+    the page cache; chscale is applied only to the block selected by
+    indexing, e.g. ``view[i0:i1, :8]`` returns scaled float32 samples.
+    '''
+
+    def __init__(self, raw, chscale, dtype=np.float32):
+        self.raw = raw
+        self.chscale = np.asarray(chscale)
+        self.dtype = dtype
+
+    @property
+    def shape(self):
+        return self.raw.shape
+
+    @property
+    def ndim(self):
+        return self.raw.ndim
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        chans = key[1] if len(key) > 1 else slice(None)
+        raw = self.raw[key]
+        return (raw * self.chscale[chans]).astype(self.dtype)
 
 
 class EEG(object):
-    def __init__(self, filename, verbose=True):
-        fd = open(filename, 'rb')
+    def __init__(self, filename, verbose=True, index_dir=None,
+                 use_index=None):
+        '''
+        filename            (str) path to a Micromed/COHERENCE .EEG file
+        verbose             (bool) log every parsed header block
+        index_dir           (str) shared directory for header indices
+        use_index           (bool) reuse / write the header index, a
+                            .hdr.json sidecar next to the file unless
+                            index_dir is given; by default only when
+                            index_dir is given
+
+        When a valid header index exists only the fields in INDEX_FIELDS are
+        set at once; the raw header records (RAW_HEADER_FIELDS, e.g. ident
+        and desc) are parsed from the file on first access.
+        '''
         if verbose:
             def log(msg):
                 print(msg)
         else:
             def log(msg): return msg
+        if use_index is None:
+            use_index = index_dir is not None
+        self.filename = filename
+        self.verbose = verbose
+        self.log = log
+        index = None
+        if use_index:
+            index = load_header_index(filename, index_dir)
+        if index is not None:
+            log('using header index for %r' % filename)
+            for k in INDEX_FIELDS:
+                setattr(self, k, index[k])
+            return
+        self._parse_header(filename, log)
+        if use_index:
+            save_header_index(filename,
+                              dict((k, getattr(self, k)) for k in INDEX_FIELDS),
+                              index_dir)
+
+    def __getattr__(self, name):
+        # only called for missing attributes: parse the raw header records
+        # of an EEG opened from its index
+        if name in RAW_HEADER_FIELDS and '_header_parsed' not in self.__dict__:
+            self._parse_header(self.filename, self.log)
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _parse_header(self, filename, log):
+        self._header_parsed = True
+        fd = open(filename, 'rb')
+        patient = {}
+        markers = []
         # read file header
         log('reading header from %r' % fd)
         ident = np.fromfile(fd, identificateur, 1)
         if not ident['coherence'][0] == b'COHERENCE':
             raise IOError('%r is not a valid EEG file' % fd)
+        # position of this file in a multi-file recording, -1 if none
+        file_nbrs = (int(ident['prevFileNbr'][0]),
+                     int(ident['thisFileNbr'][0]),
+                     int(ident['nextFileNbr'][0]))
         # go to data
         fd.seek(ident['firstBlockPos'][0])
         while True:
             hdr = np.fromfile(fd, header, 1)
+            if len(hdr) == 0:
+                log('end of file')
+                break
             cb = cbmap.get(hdr['codeBlock'][0])
             log('code block: %r' % cb)
             if cb == 'skip':
@@ -167,6 +432,8 @@ class EEG(object):
             elif cb == 'infoPatient':
                 ip = np.fromfile(fd, infoPatient, 1)
                 log('infoPatient %r' % ip)
+                patient = dict((k, ip[k][0].decode('latin-1').strip())
+                               for k in infoPatient.names)
             elif cb == 'infoMontage':
                 im = np.fromfile(fd, infoMontage, 1)
                 log('infoMontage %r' % im)
@@ -176,7 +443,7 @@ class EEG(object):
                 buff = uncrypt(fd.read(desctype.itemsize))
                 # self.buff = buff
                 # self.desctype = desctype
-                desc = np.array(buff, dtype=desctype)
+                desc = np.frombuffer(buff, desctype, 1).reshape(())
                 log('data descriptor')
                 for k in desc.dtype.fields.keys():
                     v = desc[k]
@@ -184,7 +451,7 @@ class EEG(object):
                         log("%20s\t%15s\t%15s" % (k, v.dtype, v.shape))
                     else:
                         log("%20s\t%15s" % (k, v))
-                nchan = desc['nbUsedChannels']
+                nchan = int(desc['nbUsedChannels'])
                 srate = desc['sampleFrequencyGroup'][0] * 1.0
                 chnm = [c.strip().decode('ascii')
                         for c in desc['channelName'] if c.strip()]
@@ -200,38 +467,180 @@ class EEG(object):
             elif cb == 'skip_block_len':
                 fd.seek(hdr['blockLen'][0], 1)
             elif cb == 'read markers':
-                log('ignoring markers')
-                continue
-            elif cb is None:
+                buff = fd.read(hdr['blockLen'][0])
+                markers.append(np.frombuffer(
+                    buff, marker, len(buff) // marker.itemsize))
+                log('%d markers' % len(markers[-1]))
+            elif cb == 'end' or cb is None:
                 log('done reading header')
                 break
         log('closing %r' % fd)
         fd.close()
-        for k in locals().keys():
-            setattr(self, k, locals()[k])
+        markers = np.concatenate(markers) if markers else np.empty(0, marker)
+        events = event_table(markers['sample'], markers['code'], srate)
+        for k, v in list(locals().items()):
+            setattr(self, k, v)
 
-    def read_data(self, t0=0.0, t1=None):
-        # determine sample indices
-        i0 = int(t0 * self.srate)
-        if t1 is None:
-            t1 = self.desc['recordLenInSeconds']
-        i1 = int(t1 * self.srate)
-        # pos
-        print('reading from sample %d to sample %s', i0, i1)
+    def _sample_range(self, t0=0.0, t1=None):
+        return sample_range(t0, t1, self.srate, self.nsamp)
+
+    def select_channels(self, channels=None):
+        '''
+        Resolve a channel selection given by names and/or indices.
+
+        Returns (idx, chnm, chkind) where idx indexes the multiplexed
+        channels (an array, or a slice when the selection is a regular
+        run) and chnm/chkind describe the selected channels in order.
+        '''
+        if channels is None:
+            return slice(None), list(self.chnm), list(self.chkind)
+        idx = channel_indices(self.chnm, channels, self.filename)
+        chnm = [self.chnm[i] for i in idx]
+        chkind = [self.chkind[i] for i in idx]
+        # regular runs such as 10:20 or ::2 select a strided view instead of
+        # copying columns out of the multiplexed block
+        steps = np.diff(idx)
+        if len(idx) > 1 and steps[0] > 0 and (steps == steps[0]).all():
+            idx = slice(int(idx[0]), int(idx[-1]) + 1, int(steps[0]))
+        else:
+            idx = np.array(idx, dtype=int)
+        return idx, chnm, chkind
+
+    def _read_samples(self, fd, i0, i1, idx=slice(None), out=None,
+                      dtype=np.float32):
+        '''
+        Read samples [i0, i1) through the open file `fd` and write the
+        channels selected by `idx`, scaled to physical units, into `out`:
+        a C-contiguous channel-major (nsel, i1 - i0) array of `dtype`,
+        allocated when not given.
+
+        The file is decoded in blocks of CONVERT_BLOCK samples so the only
+        temporary is one small int16 buffer; only selected columns are
+        scaled and cast.
+        '''
+        scale = self.chscale[idx, np.newaxis]
+        if out is None:
+            out = np.empty((len(scale), i1 - i0), dtype)
+        elif out.shape != (len(scale), i1 - i0):
+            raise ValueError('out has shape %r, expected %r' %
+                             (out.shape, (len(scale), i1 - i0)))
+        # samples are multiplexed, nchan int16 values per time point, so
+        # the window starts i0 * nchan * 2 bytes into the data block
         pos = self.data_offset + frequencyGroup.itemsize
-        #pos += i0 * self.nchan * 2
-        # read buff
+        pos += i0 * self.nchan * 2
+        fd.seek(pos)
+        buff = np.empty((min(CONVERT_BLOCK, i1 - i0), self.nchan), np.int16)
+        for b0 in range(0, i1 - i0, CONVERT_BLOCK):
+            n = min(CONVERT_BLOCK, i1 - i0 - b0)
+            nread = fd.readinto(buff[:n]) // (2 * self.nchan)
+            np.multiply(buff[:nread, idx].T, scale,
+                        out=out[:, b0:b0 + nread], casting='unsafe')
+            if nread < n:
+                # truncated recording
+                return out[:, :b0 + nread]
+        return out
+
+    def read_data(self, t0=0.0, t1=None, channels=None, out=None,
+                  dtype=np.float32, return_channels=False):
+        '''
+        Read the window [t0, t1) in seconds, optionally restricted to
+        `channels` (names and/or indices, see select_channels). Returns
+        (data, t) with data a channel-major (nsel, nsamples) array of
+        `dtype` (float32 or float64), written into `out` when given, or
+        (data, t, chnm, chkind) with return_channels, chnm and chkind
+        describing the rows of data.
+        '''
+        # determine sample indices
+        i0, i1 = self._sample_range(t0, t1)
+        idx, chnm, chkind = self.select_channels(channels)
+        self.log('reading from sample %d to sample %d' % (i0, i1))
+        with open(self.filename, 'rb') as fd:
+            data = self._read_samples(fd, i0, i1, idx, out, dtype)
+        t = np.arange(i0, i0 + data.shape[1]) / self.srate
+        if return_channels:
+            return data, t, chnm, chkind
+        return data, t
+
+    def iter_chunks(self, seconds, overlap=0, channels=None,
+                    return_channels=False):
+        '''
+        Iterate over the recording in blocks of `seconds`, consecutive blocks
+        sharing `overlap` seconds. Yields (data, t0) where data is a scaled
+        float32 (nchan, nsamples) array starting at t0 seconds; the last
+        block may be shorter. Only one block is held in memory at a time.
+
+        channels            (list) optional channel names or indices to keep
+        return_channels     (bool) yield (data, t0, chnm, chkind) instead,
+                            chnm and chkind describing the rows of data
+        '''
+        size = int(round(seconds * self.srate))
+        step = size - int(round(overlap * self.srate))
+        if size <= 0 or step <= 0:
+            raise ValueError('need seconds > overlap >= 0, got %r and %r' %
+                             (seconds, overlap))
+        idx, chnm, chkind = self.select_channels(channels)
+        nsamp = int(self.nsamp)
         with open(self.filename, 'rb') as fd:
-            fd.seek(pos)
-            #buff = fd.read((i1 - i0) * self.nchan * 2)
-            buff = fd.read(int(self.nsamp) * self.nchan * 2)
-        # convert to NumPy
-        data = np.frombuffer(buff, np.int16).reshape((-1, self.nchan)).T
-        data = data.astype(np.float32) * self.chscale[:, np.newaxis]
-        t = np.r_[t0:t1:1j * data.shape[1]]
-        return data.astype(np.float32), t
-
-    def to_fif(self):
+            for i0 in range(0, nsamp, step):
+                i1 = min(i0 + size, nsamp)
+                data = self._read_samples(fd, i0, i1, idx)
+                if return_channels:
+                    yield data, i0 / self.srate, chnm, chkind
+                else:
+                    yield data, i0 / self.srate
+                if i1 == nsamp:
+                    break
+
+    def find_events(self, code=None):
+        '''
+        Rows of the event table, optionally only those with marker `code`.
+        '''
+        if code is None:
+            return self.events
+        return self.events[self.events['code'] == code]
+
+    def read_epochs(self, code, tmin, tmax, channels=None, dtype=np.float32):
+        '''
+        Cut epochs [tmin, tmax) seconds around every event with marker
+        `code`, seeking straight to each event instead of reading the file.
+        Events whose epoch does not fit in the recording are dropped.
+
+        Returns (epochs, events) with epochs a (nevents, nsel, nsamples)
+        array and events the rows of the event table that were used.
+        '''
+        events = self.find_events(code)
+        s0 = int(round(tmin * self.srate))
+        s1 = int(round(tmax * self.srate))
+        keep = ((events['sample'] + s0 >= 0) &
+                (events['sample'] + s1 <= int(self.nsamp)))
+        events = events[keep]
+        idx, _, _ = self.select_channels(channels)
+        epochs = np.empty((len(events), len(self.chscale[idx]), s1 - s0),
+                          dtype)
+        with open(self.filename, 'rb') as fd:
+            for i, sample in enumerate(events['sample']):
+                self._read_samples(fd, sample + s0, sample + s1, idx,
+                                   out=epochs[i])
+        return epochs, events
+
+    def memmap(self):
+        '''
+        Map the data block as a read-only (nsamp, nchan) int16 np.memmap
+        wrapped in a ScaledMemmap, so nothing is read or scaled until a
+        slice of it is materialized.
+        '''
+        raw = np.memmap(self.filename, dtype=np.int16, mode='r',
+                        offset=self.data_offset + frequencyGroup.itemsize,
+                        shape=(int(self.nsamp), self.nchan))
+        return ScaledMemmap(raw, self.chscale)
+
+    def to_fif(self, preload=False):
+        '''
+        Return the recording as an mne Raw. Unless `preload` is set the Raw
+        reads samples from this file only when they are requested.
+        '''
+        if not preload:
+            return _micromed_raw(self)
         import mne
         print('have mne %r, version %r', mne, mne.__version__)
         from mne.io.array import RawArray
@@ -248,33 +657,260 @@ class EEG(object):
         raw = RawArray(data, info)
         return raw
 
-    def to_mat(self, name):
-        import scipy.io
-        data, time = self.read_data()
-        scipy.io.savemat(name,
-                         {'data': data,
-                          'time': time,
-                          'channel_names': self.chnm,
-                          'sampling_rate_hz': self.srate})
+    def _export_chunks(self, chunk_seconds):
+        # consecutive (i0, i1) sample ranges of chunk_seconds each
+        step = max(int(chunk_seconds * self.srate), 1)
+        nsamp = int(self.nsamp)
+        for i0 in range(0, nsamp, step):
+            yield i0, min(i0 + step, nsamp)
+
+    def to_mat(self, name, version='7.3', chunk_seconds=EXPORT_CHUNK):
+        '''
+        Save data, time, channel_names and sampling_rate_hz to a MAT-file.
+
+        version '7.3' writes an HDF5-backed MAT-file chunk by chunk with
+        h5py, so memory does not grow with the recording; '5' builds the
+        whole file in memory with scipy.io.savemat.
+        '''
+        if version != '7.3':
+            import scipy.io
+            data, time = self.read_data()
+            scipy.io.savemat(name,
+                             {'data': data,
+                              'time': time,
+                              'channel_names': self.chnm,
+                              'sampling_rate_hz': self.srate},
+                             format=version)
+            return
+        import h5py
+        nsamp = int(self.nsamp)
+        # MATLAB arrays are column-major, so the (nchan, nsamp) MATLAB data
+        # matrix is an (nsamp, nchan) HDF5 dataset in the file's own order
+        with h5py.File(name, 'w', userblock_size=512) as f:
+            data = f.create_dataset('data', (nsamp, self.nchan), np.float32)
+            data.attrs['MATLAB_class'] = np.bytes_('single')
+            t = f.create_dataset('time', (nsamp, 1), np.float64)
+            t.attrs['MATLAB_class'] = np.bytes_('double')
+            with open(self.filename, 'rb') as fd:
+                for i0, i1 in self._export_chunks(chunk_seconds):
+                    data[i0:i1] = self._read_samples(fd, i0, i1).T
+                    t[i0:i1, 0] = np.arange(i0, i1) / self.srate
+            width = max(len(c) for c in self.chnm)
+            chars = np.full((width, len(self.chnm)), ord(' '), np.uint16)
+            for i, c in enumerate(self.chnm):
+                chars[:len(c), i] = [ord(ch) for ch in c]
+            names = f.create_dataset('channel_names', data=chars)
+            names.attrs['MATLAB_class'] = np.bytes_('char')
+            names.attrs['MATLAB_int_decode'] = np.int32(2)
+            srate = f.create_dataset('sampling_rate_hz',
+                                     data=np.array([[self.srate]], np.float64))
+            srate.attrs['MATLAB_class'] = np.bytes_('double')
+        with open(name, 'r+b') as fd:
+            fd.write(mat73_header())
 
     def to_npy(self):
         return self.read_data()
 
-    def save_to_fif(self, filename):
+    def save_to_fif(self, filename, buffer_size_sec=EXPORT_CHUNK):
         raw = self.to_fif()
-        print('saving %r to %r', raw, filename)
-        raw.save(filename)
+        print('saving %r to %r' % (raw, filename))
+        raw.save(filename, buffer_size_sec=buffer_size_sec)
         print('done')
 
-    def save_to_npy(self, filename):
-        raw = self.to_npy()
-        print('saving %r to %r', raw, filename)
-        np.save(filename, raw)
+    def save_to_npy(self, filename, chunk_seconds=EXPORT_CHUNK):
+        '''
+        Save the scaled data as a channel-major float32 .npy, which np.load
+        can memory-map with mmap_mode='r', and the time vector next to it in
+        <filename>_time.npy. Both are written chunk by chunk, so memory does
+        not grow with the recording.
+        '''
+        buff = np.empty((self.nchan, max(int(chunk_seconds * self.srate), 1)),
+                        np.float32)
+        print('saving %r to %r' % (self.filename, filename))
+        with open(self.filename, 'rb') as fd:
+            batchconvert.save_channel_major_npy(
+                filename,
+                ((i0, self._read_samples(fd, i0, i1, out=buff[:, :i1 - i0]))
+                 for i0, i1 in self._export_chunks(chunk_seconds)),
+                self.nchan, int(self.nsamp))
+        with open(os.path.splitext(filename)[0] + '_time.npy', 'wb') as out:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.float64)),
+                'fortran_order': False,
+                'shape': (int(self.nsamp), )})
+            for i0, i1 in self._export_chunks(chunk_seconds):
+                (np.arange(i0, i1) / self.srate).tofile(out)
         print('done')
 
 
+class RecordingSet(object):
+    '''
+    A long-term monitoring session split over several .EEG files, read as
+    one virtual recording.
+
+    The files are chained through the prevFileNbr/thisFileNbr/nextFileNbr
+    fields of their headers. A global sample offset index maps a window of
+    the session onto the files it spans, and read_data reads only those
+    segments straight into one output array.
+    '''
+
+    def __init__(self, filename, candidates=None, verbose=False,
+                 index_dir=None):
+        '''
+        filename            (str) any file of the session
+        candidates          (list) files the chain may go through, by default
+                            the files next to `filename` with its extension
+        '''
+        if candidates is None:
+            pattern = '*' + os.path.splitext(filename)[1]
+            candidates = glob.glob(
+                os.path.join(os.path.dirname(filename), pattern))
+        first = EEG(filename, verbose, index_dir)
+        bynbr = {}
+        for fname in candidates:
+            try:
+                eeg = EEG(fname, verbose, index_dir)
+            except (IOError, ValueError, IndexError):
+                continue
+            # only files of the same session and montage can be chained
+            if (eeg.patient == first.patient and eeg.srate == first.srate and
+                    eeg.chnm == first.chnm):
+                bynbr.setdefault(eeg.file_nbrs[1], eeg)
+        bynbr[first.file_nbrs[1]] = first
+        # walk back to the first file, then forward along nextFileNbr
+        head = first
+        seen = set([head.file_nbrs[1]])
+        while head.file_nbrs[0] >= 0:
+            prev = bynbr.get(head.file_nbrs[0])
+            if (prev is None or prev.file_nbrs[1] in seen or
+                    prev.file_nbrs[2] != head.file_nbrs[1]):
+                break
+            seen.add(prev.file_nbrs[1])
+            head = prev
+        self.files = [head]
+        seen = set([head.file_nbrs[1]])
+        while self.files[-1].file_nbrs[2] >= 0:
+            last = self.files[-1]
+            nxt = bynbr.get(last.file_nbrs[2])
+            if (nxt is None or nxt.file_nbrs[1] in seen or
+                    nxt.file_nbrs[0] != last.file_nbrs[1]):
+                break
+            seen.add(nxt.file_nbrs[1])
+            self.files.append(nxt)
+
+        self.srate = first.srate
+        self.nchan = first.nchan
+        self.chnm = first.chnm
+        self.chkind = first.chkind
+        # file k holds the global samples [offsets[k], offsets[k + 1])
+        self.offsets = np.cumsum([0] + [int(f.nsamp) for f in self.files])
+        self.nsamp = int(self.offsets[-1])
+
+    @property
+    def filenames(self):
+        return [f.filename for f in self.files]
+
+    def select_channels(self, channels=None):
+        return self.files[0].select_channels(channels)
+
+    def read_data(self, t0=0.0, t1=None, channels=None, out=None,
+                  dtype=np.float32, return_channels=False):
+        '''
+        Read the window [t0, t1) in seconds of the whole session, see
+        EEG.read_data. Only the files overlapping the window are opened.
+        '''
+        i0, i1 = sample_range(t0, t1, self.srate, self.nsamp)
+        idx, chnm, chkind = self.select_channels(channels)
+        if out is None:
+            out = np.empty((len(chnm), i1 - i0), dtype)
+        k = max(np.searchsorted(self.offsets, i0, side='right') - 1, 0)
+        pos = i0
+        while pos < i1:
+            eeg, start = self.files[k], self.offsets[k]
+            stop = min(i1, self.offsets[k + 1])
+            with open(eeg.filename, 'rb') as fd:
+                eeg._read_samples(fd, pos - start, stop - start, idx,
+                                  out=out[:, pos - i0:stop - i0])
+            pos = stop
+            k += 1
+        t = np.arange(i0, i1) / self.srate
+        if return_channels:
+            return out, t, chnm, chkind
+        return out, t
+
+
+def convert(fname, output, fmt):
+    '''
+    Convert a single .EEG file to `output` in format `fmt`.
+    '''
+    eeg = EEG(fname, verbose=False)
+    if fmt == 'mat':
+        eeg.to_mat(output)
+    elif fmt == 'npy':
+        eeg.save_to_npy(output)
+    elif fmt == 'fif':
+        eeg.save_to_fif(output)
+    else:
+        raise ValueError('unknown output format %r' % (fmt, ))
+
+
+def _convert_job(job):
+    return batchconvert.convert_record(convert, *job)
+
+
+def convert_files(fnames, fmt='mat', outdir=None, manifest=None,
+                  workers=None, max_memory=None):
+    '''
+    Convert many .EEG files over a pool of worker processes and yield one
+    manifest record per file as it finishes.
+
+    fnames              (list) .EEG files to convert
+    fmt                 (str) one of OUTPUT_SUFFIX
+    outdir              (str) output directory, next to each file by default
+    manifest            (str) JSON-lines manifest, outputs it records as done
+                        are skipped so an interrupted run can be resumed
+    workers             (int) number of worker processes
+    max_memory          (int) address space limit per worker in bytes
+    '''
+    if manifest is None:
+        manifest = os.path.join(outdir or os.curdir, 'read_eeg_manifest.jsonl')
+    manifest = batchconvert.Manifest(manifest)
+    jobs = []
+    for fname in fnames:
+        output = fname + OUTPUT_SUFFIX[fmt]
+        if outdir is not None:
+            output = os.path.join(outdir, os.path.basename(output))
+        if manifest.is_done(fname, output):
+            yield dict(manifest.records[output], status='skipped')
+        else:
+            jobs.append((fname, output, fmt))
+    for rec in batchconvert.run_pool(_convert_job, jobs, workers, max_memory):
+        manifest.add(rec)
+        yield rec
+
+
 if __name__ == '__main__':
-    import sys
-    for fname in sys.argv[1:]:
-        print('converting %r..' % (fname, ))
-        EEG(fname).to_mat(fname + '.mat')
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert Micromed .EEG files, resuming from a manifest.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-f', '--format', choices=sorted(OUTPUT_SUFFIX),
+                        default='mat')
+    parser.add_argument('-o', '--outdir', default=None)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes')
+    parser.add_argument('-m', '--manifest', default=None)
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='address space limit per worker in MB')
+    args = parser.parse_args()
+    if args.outdir is not None and not os.path.exists(args.outdir):
+        os.makedirs(args.outdir)
+    max_memory = None
+    if args.max_memory is not None:
+        max_memory = int(args.max_memory * 2 ** 20)
+    for rec in convert_files(args.files, args.format, args.outdir,
+                             args.manifest, args.jobs, max_memory):
+        print('%-8s %r -> %r (%.1f s)' % (rec['status'], rec['source'],
+                                          rec['output'], rec['duration']))
+        if rec['status'] == 'failed':
+            print('         %s' % rec['error'])
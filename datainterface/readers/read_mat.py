@@ -1,5 +1,287 @@
+import os
+import numpy as np
 import scipy.io
+import scipy.sparse
 import json
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+try:
+    H5PY_SUPPORT = True
+    import h5py
+except ImportError:
+    H5PY_SUPPORT = False
+try:
+    from .cache import LRUCache
+    from .batchconvert import replacing_dir, run_pool, source_stamp
+except (ImportError, ValueError):
+    from cache import LRUCache
+    from batchconvert import replacing_dir, run_pool, source_stamp
+
+try:
+    mat_struct = scipy.io.matlab.mat_struct
+except AttributeError:
+    mat_struct = scipy.io.matlab.mio5_params.mat_struct
+
+# name of the json file of a directory written by convertMatToSidecar
+SIDECAR_MANIFEST = 'manifest.json'
+
+# bytes of arrays kept by the decode cache of MatReader.loadmat(cache=True)
+DECODE_CACHE_BYTES = 512 * 2 ** 20
+
+
+def is_mat73(filename):
+    '''
+    True for a MAT-file v7.3, i.e. an HDF5 file behind the 128 byte MAT
+    header, which scipy.io.loadmat cannot read.
+    '''
+    with open(filename, 'rb') as fd:
+        header = fd.read(128)
+    return header[:10] == b'MATLAB 7.3' or (
+        H5PY_SUPPORT and h5py.is_hdf5(filename))
+
+
+class MatStruct(Mapping):
+    '''
+    Read-only dict view of a MATLAB struct loaded by scipy.io.loadmat. Each
+    field is converted to dicts and lists only when it is first accessed.
+    '''
+
+    def __init__(self, matobj, reader):
+        self._matobj = matobj
+        self._reader = reader
+        self._fields = {}
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            if key not in self._matobj._fieldnames:
+                raise KeyError(key)
+            self._fields[key] = self._reader._lazy(
+                getattr(self._matobj, key))
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._matobj._fieldnames)
+
+    def __len__(self):
+        return len(self._matobj._fieldnames)
+
+    def todict(self):
+        return self._reader._todict(self._matobj)
+
+
+class H5MatArray(object):
+    '''
+    A numeric MATLAB array of a v7.3 file, backed by its h5py dataset.
+
+    MATLAB is column-major, so shape and indices are given in MATLAB order.
+    Indexing follows numpy, index arrays included, and reads only the
+    selected part of the dataset. read() loads
+    the whole array, squeezed like scipy.io.loadmat(squeeze_me=True).
+    '''
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape[::-1]
+        self.ndim = len(self.shape)
+        self.dtype = dataset.dtype
+        self.matlab_class = _matlab_class(dataset)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+        if ellipsis:
+            i = ellipsis[0]
+            key = (key[:i] + (slice(None), ) * (self.ndim - len(key) + 1) +
+                   key[i + 1:])
+        key = key + (slice(None), ) * (self.ndim - len(key))
+        if len(key) > self.ndim:
+            raise IndexError('too many indices for a %d-d array' % self.ndim)
+
+        # h5py takes increasing indices and a single index list, so array
+        # keys are read as sorted unique indices (or, past the first, the
+        # range they span) and then indexed with numpy in the order given
+        h5key, post = [], []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, (int, np.integer)):
+                if not -n <= k < n:
+                    raise IndexError('index %d out of range' % k)
+                h5key.append(int(k) % n)
+                continue
+            if isinstance(k, slice):
+                start, stop, step = k.indices(n)
+                if step > 0:
+                    h5key.append(slice(start, stop, step))
+                    post.append(slice(None))
+                    continue
+                k = np.arange(start, stop, step)
+            k = np.asarray(k)
+            if k.dtype == bool:
+                k = np.nonzero(k)[0]
+            if k.size and not (-n <= k.min() and k.max() < n):
+                raise IndexError('index out of range for axis of size %d' % n)
+            k = k.astype(int) % n if k.size else k.astype(int)
+            uniq = np.unique(k)
+            if not any(isinstance(h, list) for h in h5key):
+                h5key.append(uniq.tolist())
+                post.append(np.searchsorted(uniq, k))
+            else:
+                lo = uniq[0] if uniq.size else 0
+                hi = uniq[-1] + 1 if uniq.size else 0
+                h5key.append(slice(lo, hi))
+                post.append(k - lo)
+        data = np.asarray(self.dataset[tuple(h5key[::-1])]).T
+        if any(isinstance(p, np.ndarray) for p in post):
+            data = data[tuple(post)]
+        return self._convert(data)
+
+    def __array__(self, dtype=None):
+        data = self.read()
+        return data if dtype is None else data.astype(dtype)
+
+    def _convert(self, data):
+        if self.matlab_class == 'logical':
+            return data.astype(bool)
+        return data
+
+    def read(self):
+        return np.squeeze(self[...])
+
+
+def _matlab_class(node):
+    cls = node.attrs.get('MATLAB_class', b'')
+    return cls.decode('ascii') if isinstance(cls, bytes) else str(cls)
+
+
+class H5MatStruct(Mapping):
+    '''
+    Read-only dict view of a v7.3 MAT-file or of one of its structs. Items
+    are created lazily: numeric arrays as H5MatArray, structs as nested
+    H5MatStruct, while chars, cells and sparse matrices are read on access.
+    '''
+
+    def __init__(self, group, names=None):
+        self.group = group
+        self._names = [name for name in group.keys()
+                       if not name.startswith('#')]
+        if names is not None:
+            self._names = [name for name in self._names if name in names]
+
+    def __getitem__(self, key):
+        if key not in self._names:
+            raise KeyError(key)
+        return _h5item(self.group[key])
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def todict(self):
+        '''
+        Read every item into nested dicts of numpy arrays.
+        '''
+        return dict((key, _h5read(value)) for key, value in self.items())
+
+    def close(self):
+        self.group.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _h5read(value):
+    if isinstance(value, H5MatStruct):
+        return value.todict()
+    if isinstance(value, H5MatArray):
+        return value.read()
+    if isinstance(value, list):
+        return [_h5read(v) for v in value]
+    return value
+
+
+def _h5item(node):
+    if isinstance(node, h5py.Group):
+        if 'MATLAB_sparse' in node.attrs:
+            nrows = int(node.attrs['MATLAB_sparse'])
+            jc = node['jc'][()]
+            shape = (nrows, len(jc) - 1)
+            if 'data' not in node:
+                return scipy.sparse.csc_matrix(shape)
+            return scipy.sparse.csc_matrix(
+                (node['data'][()], node['ir'][()], jc), shape=shape)
+        return H5MatStruct(node)
+    cls = _matlab_class(node)
+    if node.attrs.get('MATLAB_empty', 0):
+        return np.empty(0)
+    if cls == 'char':
+        chars = node[()].T
+        rows = [''.join(chr(c) for c in row).rstrip() for row in chars]
+        return rows[0] if len(rows) == 1 else rows
+    if node.dtype == h5py.ref_dtype:
+        # cell array, or the fields of a struct array: one reference per item
+        refs = node[()].T
+        items = [_h5item(node.file[ref]) for ref in refs.ravel()]
+        return items[0] if len(items) == 1 else items
+    return H5MatArray(node)
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return sum(_nbytes(v) for v in value.flat)
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def _freeze(value):
+    # cached structures are shared between callers, so make them read-only
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+        if value.dtype == object:
+            for v in value.flat:
+                _freeze(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _freeze(v)
+    return value
+
+
+# decoded v5 files keyed by path, mtime, size and the variables loaded
+_decode_cache = LRUCache(maxsize=None, maxbytes=DECODE_CACHE_BYTES,
+                         sizeof=_nbytes)
+
+
+def _cache_key(filename, variable_names):
+    stamp = source_stamp(filename)
+    return (stamp['path'], stamp['size'], stamp['mtime'],
+            None if variable_names is None else tuple(variable_names))
+
+
+def _load_job(job):
+    # runs in a worker process
+    filename, variable_names = job
+    try:
+        data = MatReader().loadmat(filename, variable_names)
+    except Exception as e:
+        return filename, None, '%s: %s' % (type(e).__name__, e)
+    return filename, data, None
 
 
 class MatReader():
@@ -11,26 +293,121 @@ class MatReader():
     def __init__(self, filename=None):
         self.filename = filename
 
-    def loadmat(self, filename):
+    def loadmat(self, filename=None, variable_names=None, lazy=False,
+                cache=False):
         '''
         this function should be called instead of direct spio.loadmat
         as it cures the problem of not properly recovering python dictionaries
         from mat files. It calls the function check keys to cure all entries
         which are still mat-objects
+
+        variable_names      (list) variables to load, None for all of them
+        lazy                (bool) return structs as MatStruct views that are
+                            converted field by field on access
+        cache               (bool) keep the decoded data in a process-wide
+                            LRU cache keyed by path and mtime, bounded to
+                            DECODE_CACHE_BYTES of arrays; cached data is
+                            shared between callers and read-only
+
+        v7.3 (HDF5) files are opened with h5py and read into nested dicts of
+        arrays, or with lazy=True returned as an H5MatStruct: nothing is read
+        until an item is accessed, and numeric arrays are H5MatArray that
+        read only the slices asked for. The H5MatStruct keeps the file open
+        until closed, e.g. by using it in a with statement.
         '''
+        filename = filename or self.filename
+        if is_mat73(filename):
+            if not H5PY_SUPPORT:
+                raise ImportError(
+                    'h5py is needed to read the MAT-file v7.3 %s' % filename)
+            struct = H5MatStruct(h5py.File(filename, 'r'), variable_names)
+            if lazy:
+                return struct
+            with struct:
+                return struct.todict()
+
+        if cache and not lazy:
+            key = _cache_key(filename, variable_names)
+            data = _decode_cache.get(key)
+            if data is None:
+                data = _freeze(self.loadmat(filename, variable_names))
+                _decode_cache.put(key, data)
+            return data
+
         data = scipy.io.loadmat(
             filename,
+            variable_names=variable_names,
             struct_as_record=False,
             squeeze_me=True)
+        if lazy:
+            for key in data:
+                if isinstance(data[key], mat_struct):
+                    data[key] = MatStruct(data[key], self)
+            return data
         return self._check_keys(data)
 
+    def loadmany(self, filenames, workers=4, processes=False,
+                 variable_names=None):
+        '''
+        Load many mat files with at most `workers` of them in flight, and
+        yield (filename, data, error) as each one finishes; error is None on
+        success and a message otherwise.
+
+        Results go through the decode cache of loadmat(cache=True), so only
+        the files missing from it are sent to the pool. With processes=True
+        files are decoded in worker processes, which suits large v5 files
+        whose decoding holds the GIL. v7.3 files are read in full and not
+        cached.
+        '''
+        pending = []
+        for filename in filenames:
+            data = None
+            try:
+                if not is_mat73(filename):
+                    data = _decode_cache.get(
+                        _cache_key(filename, variable_names))
+            except OSError as e:
+                yield filename, None, '%s: %s' % (type(e).__name__, e)
+                continue
+            if data is None:
+                pending.append(filename)
+            else:
+                yield filename, data, None
+        if not pending:
+            return
+
+        if processes:
+            func = _load_job
+        else:
+            def func(job):
+                filename, variable_names = job
+                try:
+                    data = self.loadmat(filename, variable_names)
+                except Exception as e:
+                    return filename, None, '%s: %s' % (type(e).__name__, e)
+                return filename, data, None
+        for filename, data, error in run_pool(
+                func, [(f, variable_names) for f in pending], workers,
+                threads=not processes):
+            if error is None and not is_mat73(filename):
+                data = _freeze(data)
+                _decode_cache.put(_cache_key(filename, variable_names), data)
+            yield filename, data, error
+
+    def _lazy(self, elem):
+        if isinstance(elem, mat_struct):
+            return MatStruct(elem, self)
+        if isinstance(elem, np.ndarray) and elem.dtype == object:
+            return self._tolist(elem)
+        return elem
+
     def _check_keys(self, dict):
         '''
         checks if entries in dictionary are mat-objects. If yes
         todict is called to change them to nested dictionaries
         '''
         for key in dict:
-            if isinstance(dict[key], scipy.io.matlab.mio5_params.mat_struct):
+            if isinstance(dict[key], mat_struct):
                 dict[key] = self._todict(dict[key])
         return dict
 
@@ -41,10 +418,10 @@ class MatReader():
         dict = {}
         for strg in matobj._fieldnames:
             elem = matobj.__dict__[strg]
-            if isinstance(elem, scipy.io.matlab.mio5_params.mat_struct):
-                dict[strg] = _todict(elem)
-            elif isinstance(elem, np.ndarray):
-                dict[strg] = _tolist(elem)
+            if isinstance(elem, mat_struct):
+                dict[strg] = self._todict(elem)
+            elif isinstance(elem, np.ndarray) and elem.dtype == object:
+                dict[strg] = self._tolist(elem)
             else:
                 dict[strg] = elem
         return dict
@@ -57,22 +434,97 @@ class MatReader():
         '''
         elem_list = []
         for sub_elem in ndarray:
-            if isinstance(sub_elem, scipy.io.matlab.mio5_params.mat_struct):
+            if isinstance(sub_elem, mat_struct):
                 elem_list.append(self._todict(sub_elem))
-            elif isinstance(sub_elem, np.ndarray):
+            elif isinstance(sub_elem, np.ndarray) and sub_elem.dtype == object:
                 elem_list.append(self._tolist(sub_elem))
             else:
                 elem_list.append(sub_elem)
         return elem_list
 
-    def convertMatToJSON(self, matData, fileName):
-        for key in matData.keys():
-            if (type(matData[key])) is np.ndarray:
-                serializedData = pickle.dumps(
-                    matData[key], protocol=0)  # protocol 0 is printable ASCII
-                jsonData[key] = serializedData
-            else:
-                jsonData[key] = matData[key]
+    def convertMatToSidecar(self, matData, dirname):
+        '''
+        Save loaded mat data to the directory `dirname`: every array goes to
+        its own .npy file and everything else, e.g. scalars, strings and the
+        nesting of structs and cells, to manifest.json, where an array is
+        {"__npy__": <file name>}, a sparse matrix {"__sparse__": <format>}
+        with its component arrays and a complex number {"__complex__":
+        [real, imag]}. Read it back with loadSidecar.
+
+        The directory is written next to `dirname` and renamed into place,
+        so an existing sidecar is replaced as a whole.
+        '''
+        with replacing_dir(dirname) as tmpdir:
+            manifest = self._tosidecar(matData, tmpdir, [])
+            with open(os.path.join(tmpdir, SIDECAR_MANIFEST), 'w') as f:
+                json.dump(manifest, f)
+
+    def _savenpy(self, array, dirname, names):
+        # numbered file names, since struct fields may hold any character
+        name = 'array%d.npy' % len(names)
+        names.append(name)
+        np.save(os.path.join(dirname, name), array)
+        return name
+
+    def _tosidecar(self, elem, dirname, names):
+        if isinstance(elem, mat_struct):
+            elem = self._todict(elem)
+        elif isinstance(elem, (MatStruct, H5MatStruct)):
+            elem = elem.todict()
+        elif isinstance(elem, H5MatArray):
+            elem = elem.read()
+        if isinstance(elem, np.ndarray) and elem.dtype == object:
+            elem = self._tolist(elem)
+
+        if isinstance(elem, Mapping):
+            return dict((key, self._tosidecar(value, dirname, names))
+                        for key, value in elem.items())
+        if isinstance(elem, (list, tuple)):
+            return [self._tosidecar(value, dirname, names) for value in elem]
+        if scipy.sparse.issparse(elem):
+            if elem.format not in ('csr', 'csc'):
+                elem = elem.tocsr()
+            return {'__sparse__': elem.format,
+                    'shape': list(elem.shape),
+                    'data': self._savenpy(elem.data, dirname, names),
+                    'indices': self._savenpy(elem.indices, dirname, names),
+                    'indptr': self._savenpy(elem.indptr, dirname, names)}
+        if isinstance(elem, np.ndarray):
+            return {'__npy__': self._savenpy(elem, dirname, names)}
+        if isinstance(elem, np.generic):
+            elem = elem.item()
+        if isinstance(elem, complex):
+            return {'__complex__': [elem.real, elem.imag]}
+        if isinstance(elem, bytes):
+            return elem.decode('latin-1')
+        return elem
+
+    def loadSidecar(self, dirname, mmap_mode='r'):
+        '''
+        Load a directory written by convertMatToSidecar. Arrays are memory
+        mapped with `mmap_mode`, None to read them into memory.
+        '''
+        with open(os.path.join(dirname, SIDECAR_MANIFEST), 'r') as f:
+            manifest = json.load(f)
+        return self._fromsidecar(manifest, dirname, mmap_mode)
 
-        with contextlib.closing(bz2.BZ2File(fileName, 'wb')) as f:
-            json.dump(jsonData, f)
+    def _fromsidecar(self, elem, dirname, mmap_mode):
+        if isinstance(elem, dict):
+            if list(elem) == ['__npy__']:
+                return np.load(os.path.join(dirname, elem['__npy__']),
+                               mmap_mode=mmap_mode)
+            if list(elem) == ['__complex__']:
+                return complex(*elem['__complex__'])
+            if '__sparse__' in elem:
+                matrix = (scipy.sparse.csr_matrix
+                          if elem['__sparse__'] == 'csr'
+                          else scipy.sparse.csc_matrix)
+                return matrix(tuple(np.load(os.path.join(dirname, elem[key]))
+                                    for key in ('data', 'indices', 'indptr')),
+                              shape=tuple(elem['shape']))
+            return dict((key, self._fromsidecar(value, dirname, mmap_mode))
+                        for key, value in elem.items())
+        if isinstance(elem, list):
+            return [self._fromsidecar(value, dirname, mmap_mode)
+                    for value in elem]
+        return elem
@@ -1,6 +1,10 @@
 import numpy as np
 import zipfile
 import os
+try:
+    from . import surfgeom
+except (ImportError, ValueError):
+    import surfgeom
 
 class LoadSurface():
     def loadsurfdata(self, directory, use_subcort=False):
@@ -56,19 +60,11 @@ class LoadSurface():
             self.regmap = regmap
             return (verts, normals, areas, regmap)
 
-    def __compute_triangle_areas(self, vertices, triangles):
-        """Calculates the area of triangles making up a surface."""
-        tri_u = vertices[triangles[:, 1], :] - vertices[triangles[:, 0], :]
-        tri_v = vertices[triangles[:, 2], :] - vertices[triangles[:, 0], :]
-        tri_norm = np.cross(tri_u, tri_v)
-        triangle_areas = np.sqrt(np.sum(tri_norm ** 2, axis=1)) / 2.0
-        triangle_areas = triangle_areas[:, np.newaxis]
-        return triangle_areas
-
     def _compute_vertex_areas(self, vertices, triangles):
-        triangle_areas = self.__compute_triangle_areas(vertices, triangles)
-        vertex_areas = np.zeros((vertices.shape[0]))
-        for triang, vertices in enumerate(triangles):
-            for i in range(3):
-                vertex_areas[vertices[i]] += 1. / 3. * triangle_areas[triang]
-        return vertex_areas
+        return surfgeom.vertex_areas(vertices, triangles)
+
+    def compute_region_areas(self, nregions=None):
+        '''
+        Surface area of each region of the loaded surface.
+        '''
+        return surfgeom.region_areas(self.areas, self.regmap, nregions)
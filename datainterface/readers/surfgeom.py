@@ -0,0 +1,86 @@
+'''
+Vectorized geometry of triangulated surfaces.
+
+Each kernel makes a single scatter-add pass over the triangles with
+np.bincount, so cost is linear in the mesh size with no Python loop:
+
+- triangle_areas, vertex_areas: a third of each triangle's area per vertex
+- vertex_normals: area-weighted average of the normals of adjacent faces
+- region_areas: surface area per region of a vertex region mapping
+- adjacency: sparse vertex adjacency matrix of the triangle edges
+'''
+import numpy as np
+import scipy.sparse
+
+
+def _face_normals(vertices, triangles):
+    # cross products, whose norm is twice the triangle area
+    tri_u = vertices[triangles[:, 1], :] - vertices[triangles[:, 0], :]
+    tri_v = vertices[triangles[:, 2], :] - vertices[triangles[:, 0], :]
+    return np.cross(tri_u, tri_v)
+
+
+def triangle_areas(vertices, triangles):
+    '''
+    Area of each triangle, shape (ntri, ).
+    '''
+    tri_norm = _face_normals(vertices, triangles)
+    return np.sqrt(np.einsum('ij,ij->i', tri_norm, tri_norm)) / 2.0
+
+
+def vertex_areas(vertices, triangles):
+    '''
+    Area attributed to each vertex: a third of the area of every triangle
+    it belongs to, shape (nvert, ).
+    '''
+    areas = triangle_areas(vertices, triangles) / 3.
+    return np.bincount(triangles.ravel(), weights=np.repeat(areas, 3),
+                       minlength=vertices.shape[0])
+
+
+def vertex_normals(vertices, triangles):
+    '''
+    Unit normal of each vertex, the average of the normals of its triangles
+    weighted by their area, shape (nvert, 3). Vertices that belong to no
+    triangle get a zero normal.
+    '''
+    tri_norm = np.repeat(_face_normals(vertices, triangles), 3, axis=0)
+    idx = triangles.ravel()
+    normals = np.column_stack([
+        np.bincount(idx, weights=tri_norm[:, k], minlength=vertices.shape[0])
+        for k in range(3)])
+    norm = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+    norm[norm == 0] = 1.
+    return normals / norm[:, np.newaxis]
+
+
+def region_areas(areas, regmap, nregions=None):
+    '''
+    Surface area of each region given the area of each vertex and its
+    region index in `regmap`; negative indices (unknown region) are left
+    out. Shape (nregions, ), by default max(regmap) + 1.
+    '''
+    regmap = np.asarray(regmap)
+    known = regmap >= 0
+    if nregions is None:
+        nregions = regmap.max() + 1 if known.any() else 0
+    return np.bincount(regmap[known], weights=np.asarray(areas)[known],
+                       minlength=nregions)
+
+
+def adjacency(triangles, nvertices=None):
+    '''
+    Symmetric (nvert, nvert) CSR matrix with a 1 for every pair of vertices
+    sharing a triangle edge.
+    '''
+    triangles = np.asarray(triangles)
+    if nvertices is None:
+        nvertices = triangles.max() + 1 if triangles.size else 0
+    rows = triangles[:, [0, 1, 2, 1, 2, 0]].ravel()
+    cols = triangles[:, [1, 2, 0, 0, 1, 2]].ravel()
+    adj = scipy.sparse.csr_matrix(
+        (np.ones(len(rows), np.int8), (rows, cols)),
+        shape=(nvertices, nvertices))
+    # edges shared by two triangles were summed, make them 1 again
+    adj.data[:] = 1
+    return adj
@@ -1,8 +1,9 @@
-import os
 import re
 import mne
 import numpy as np
 
+from ..readers.read_ades import AdesRecording, read_ades_header
+
 
 class SeegRecording():
     def __init__(self, contacts, data, sampling_rate):
@@ -42,63 +43,12 @@ class SeegRecording():
 
     @classmethod
     def from_ades(cls, filename):
-        data_file = os.path.splitext(filename)[0] + ".dat"
-
-        contact_names = []
-        contacts = []
-        sampling_rate = None
-        nsamples = None
-        seeg_idxs = []
+        # the header (and .bad file) parse is shared with read_ades and
+        # cached; only the good SEEG columns are read from the .dat file
+        header = read_ades_header(filename)
+        data = AdesRecording(filename).read(channels=header.seeg_idxs)
 
-        bad_channels = []
-        bad_file = filename + ".bad"
-        if os.path.isfile(bad_file):
-            with open(bad_file, 'r') as fd:
-                bad_channels = [ch.strip()
-                                for ch in fd.readlines() if ch.strip() != ""]
-
-        with open(filename, 'r') as fd:
-            fd.readline()  # ADES header file
-
-            kw, sampling_rate = [s.strip()
-                                 for s in fd.readline().strip().split('=')]
-            assert kw == 'samplingRate'
-            sampling_rate = float(sampling_rate)
-
-            kw, nsamples = [s.strip()
-                            for s in fd.readline().strip().split('=')]
-            assert kw == 'numberOfSamples'
-            nsamples = int(nsamples)
-
-            channel_idx = 0
-            for line in fd.readlines():
-                if not line.strip():
-                    continue
-
-                parts = [p.strip() for p in line.strip().split('=')]
-                if len(parts) > 1 and parts[1] == 'SEEG':
-                    name, idx = re.match(
-                        "([A-Za-z]+[']*)([0-9]+)", parts[0]).groups()
-                    idx = int(idx)
-                    if parts[0] not in bad_channels:
-                        contacts.append((name, idx))
-                        seeg_idxs.append(channel_idx)
-
-                channel_idx += 1
-
-        data = np.fromfile(data_file, dtype='f4')
-        ncontacts = data.size // nsamples
-
-        if data.size != nsamples * ncontacts:
-            print("!! data.size != nsamples*ncontacts")
-            print("!! %d != %d %d" % (data.size, nsamples, ncontacts))
-            print("!! Ignoring nsamples")
-            nsamples = int(data.size / ncontacts)
-
-        data = data.reshape((nsamples, ncontacts)).T
-        data = data[seeg_idxs, :]
-
-        return cls(contacts, data, sampling_rate)
+        return cls(header.contacts, data, header.srate)
 
     @classmethod
     def from_fif(cls, filename, drop_channels=None, rename_channels=None):